@@ -3,7 +3,10 @@ Sub-module imports
 '''
 import avfet_modules.cheb_fet as cheb_fet
 import avfet_modules.cheb_plus as cheb_plus
+import avfet_modules.leg_plus as leg_plus
 import avfet_modules.project_tools as project_tools
+import avfet_modules.table_cache as table_cache
 import avfet_modules.terminal_options as terminal_options
 import avfet_modules.timestepping as timestepping
+import avfet_modules.warmup as warmup
 
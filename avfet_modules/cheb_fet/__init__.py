@@ -1,27 +1,192 @@
-from firedrake        import assemble, constant, functionspace
-from ufl              import split_functions
+from firedrake        import assemble, constant, exceptions, function, functionspace, solving, ufl_expr, variational_solver
+from firedrake.petsc  import PETSc
+from ufl              import Coefficient, Measure, as_tensor, as_ufl, derivative, indices, inner, replace, split_functions
+from ufl.algorithms   import expand_derivatives
+from ufl.constantvalue import Zero
+from ufl.form         import Form
 from finat            import ufl
 import avfet_modules.cheb_plus as cheb_plus
+import avfet_modules.leg_plus as leg_plus
+import collections
 import itertools
+import math
+import numbers
 import numpy
+import os
+import time
+import types
+import weakref
 
 
 
 '''
-[Loosely: Scripts for defining function spaces]
+[Loosely: Polynomial bases in time, and the tables defining them]
 '''
 
 
 
-def FETFunctionSpace(mesh, family, degree=None, order=0, name=None, vfamily=None, vdegree=None):
+bases = {
+    "chebyshev": types.SimpleNamespace(
+        mulprojtensor = cheb_plus.chebmulprojtensor,
+        projmat       = cheb_plus.chebprojmat,
+        leggauss      = cheb_plus.chebleggauss,
+        dualweights   = cheb_plus.chebdualweights,
+        intmat        = cheb_plus.chebintmat,
+        intvander     = cheb_plus.chebintvander,
+        shiftmat      = cheb_plus.chebshiftmat,
+    ),
+    "legendre": types.SimpleNamespace(
+        mulprojtensor = leg_plus.legmulprojtensor,
+        projmat       = leg_plus.legprojmat,
+        leggauss      = leg_plus.legleggauss,
+        dualweights   = leg_plus.legdualweights,
+        intmat        = leg_plus.legintmat,
+        intvander     = leg_plus.legintvander,
+        shiftmat      = leg_plus.legshiftmat,
+    ),
+}
+
+
+
+def _basis_tables(basis):
+    # Retrieve the tables defining the given basis in time
+    if basis not in bases:
+        raise ValueError(f"Unknown basis in time '{basis}': must be one of {list(bases)}")
+
+    return bases[basis]
+
+
+
+class FETList(tuple):
     '''
     [DOCUMENTATION GOES HERE]
 
-    [Loosely: Creates a simple MIXED function space object containing order+1 copies of the given function space, storing also the order as a variable for use in creating cheb_fet function lists]
+    [Loosely: A cheb_fet list (a tuple of the coefficients in time of a space-time function), which also remembers the basis in time those coefficients are with respect to]
+
+    [affine: If the coefficients are affine in the coefficients in time w of a field of a function (As for the outputs of FETsplit, and of integrate and project applied to them), the dependence u = offset + tmat @ w, as a namespace with attributes function, field, tmat and offset (A list, with None for zero entries); else None]
     '''
 
-    # Create mixed function space
-    if name:
+    def __new__(cls, components, basis="chebyshev", affine=None):
+        new = super().__new__(cls, components)
+        new.basis = basis
+        new.affine = affine
+
+        return new
+
+
+
+def _FETaffine(affine, mat, offset=None):
+    # Compose the affine dependence of a cheb_fet list with the linear map mat, and add offset (Returning None if there is no dependence)
+    if affine is None:
+        return None
+
+    offset = [None]*len(mat) if offset is None else list(offset)
+    for (k, mat_) in enumerate(mat):
+        for (coeff, offset_) in zip(mat_, affine.offset):
+            if coeff != 0 and offset_ is not None:
+                offset[k] = float(coeff)*offset_ if offset[k] is None else offset[k] + float(coeff)*offset_
+
+    return types.SimpleNamespace(function=affine.function, field=affine.field, tmat=mat @ affine.tmat, offset=offset)
+
+
+
+def _coefficient(value, literal=False):
+    # Wrap a scalar coefficient for use in a form: as a literal (Folded into the compiled kernel), or as a Constant (A kernel argument)
+    return float(value) if literal else constant.Constant(float(value))
+
+
+
+def _basis(*u_tup):
+    # Retrieve the (common) basis in time of cheb_fet lists (Plain tuples are taken to be in the Chebyshev basis)
+    basis_set = {getattr(u, "basis", "chebyshev") for u in u_tup}
+    if len(basis_set) > 1:
+        raise ValueError(f"cheb_fet lists with different bases in time cannot be combined: {sorted(basis_set)}")
+
+    return basis_set.pop()
+
+
+
+'''
+[Loosely: Scripts for defining function spaces]
+'''
+
+
+
+layouts = ["block", "interleaved"]
+
+
+
+def _check_layout(layout):
+    # Check the layout of coefficients in time is known
+    if layout not in layouts:
+        raise ValueError(f"Unknown layout in time '{layout}': must be one of {layouts}")
+
+
+
+def _layouts(space):
+    # Retrieve the layouts of the fields of a FET function space
+    return getattr(space, "layout", ["block"]*len(space.order))
+
+
+
+def _FETblock(space, k):
+    # Index of the first part (i.e. subfunction) of the k-th field of a FET function space
+    return sum(
+        1 if layout_ == "interleaved" else order_+1
+        for (order_, layout_) in zip(space.order[:k], _layouts(space)[:k])
+    )
+
+
+
+def _FETcomponent(w, i):
+    # Extract the i-th coefficient in time of a part with interleaved layout (Stored in its final value dimension)
+    if len(w.ufl_shape) == 1:
+        return w[i]
+
+    ind = indices(len(w.ufl_shape) - 1)
+    return as_tensor(w[ind + (i,)], ind)
+
+
+
+# Spatial function spaces of fields, per FET function space (Held weakly, so that spaces are freed with their functions) and field (Collapsed once, so that they may be compared by identity)
+_FETspatial_spaces = weakref.WeakKeyDictionary()
+
+
+
+def _FETspatial(space, k):
+    # Spatial function space of (each coefficient in time of) the k-th field of a FET function space (For interleaved layout, the space of its single part, with the coefficients in time as final value dimension)
+    spaces = _FETspatial_spaces.setdefault(space, {})
+    if k not in spaces:
+        # (A single space with interleaved layout is not mixed, so is its own only part, as in FETsplit; a mixed space with a single part is not, and is collapsed as usual)
+        if len(space.order) == 1 and _layouts(space)[0] == "interleaved":
+            spaces[k] = space
+        else:
+            spaces[k] = space.sub(_FETblock(space, k)).collapse()
+
+    return spaces[k]
+
+
+
+def FETFunctionSpace(mesh, family, degree=None, order=0, name=None, vfamily=None, vdegree=None, basis="chebyshev", layout="block"):
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: Creates a simple MIXED function space object containing order+1 copies of the given function space, storing also the order (and basis) in time as a variable for use in creating cheb_fet function lists]
+
+    [basis: "chebyshev" (default) or "legendre"]
+
+    [layout: "block" (default), as above, or "interleaved", for a single (non-mixed) function space with the coefficients in time as an extra, final value dimension, so that the coefficients in time at each node are numbered contiguously (FETsplit and the rest of cheb_fet treat both alike)]
+    '''
+    # Check basis and layout
+    _basis_tables(basis)
+    _check_layout(layout)
+
+    # Create function space with coefficients in time interleaved...
+    if layout == "interleaved":
+        element = functionspace.make_scalar_element(mesh, family, degree, vfamily, vdegree, None) if isinstance(family, str) else family
+        new = functionspace.FunctionSpace(mesh, ufl.VectorElement(element, dim=order+1), name=name)
+    # ...Or mixed function space
+    elif name:
         new = functionspace.MixedFunctionSpace([
             functionspace.FunctionSpace(mesh, family, degree=degree, name=name+"_"+str(i), vfamily=vfamily, vdegree=vdegree)
             for i in range(order+1)
@@ -32,24 +197,38 @@ def FETFunctionSpace(mesh, family, degree=None, order=0, name=None, vfamily=None
             for i in range(order+1)
         ])
 
-    # Store order
+    # Store order, basis and layout
     new.order = [order]
+    new.basis = [basis]
+    new.layout = [layout]
 
     return new
 
 
 
-def FETVectorFunctionSpace(mesh, family, degree=None, order=0, dim=None, name=None, vfamily=None, vdegree=None, variant=None):
+def FETVectorFunctionSpace(mesh, family, degree=None, order=0, dim=None, name=None, vfamily=None, vdegree=None, variant=None, basis="chebyshev", layout="block"):
     '''
     [DOCUMENTATION GOES HERE]
 
     [Loosely: Copies VectorFunctionSpace, just without forgetting the order]
     '''
+    _check_layout(layout)
+
     sub_element = functionspace.make_scalar_element(mesh, family, degree, vfamily, vdegree, variant)
     dim = dim or mesh.ufl_cell().geometric_dimension()
+
+    # (With coefficients in time interleaved, the vector and time dimensions form a tensor)
+    if layout == "interleaved":
+        new = functionspace.FunctionSpace(mesh, ufl.TensorElement(sub_element, shape=(dim, order+1)), name=name)
+        new.order = [order]
+        new.basis = [basis]
+        new.layout = [layout]
+
+        return new
+
     element = ufl.VectorElement(sub_element, dim=dim)
 
-    return FETFunctionSpace(mesh, element, order=order, name=name)
+    return FETFunctionSpace(mesh, element, order=order, name=name, basis=basis)
 
 
 
@@ -57,16 +236,20 @@ def FETMixedFunctionSpace(spaces, name=None, mesh=None):
     '''
     [DOCUMENTATION GOES HERE]
 
-    [Loosely: Copies functionspace.MixedFunctionSpace, but remembers the orders in time of the component spaces in a new order array]
+    [Loosely: Copies functionspace.MixedFunctionSpace, but remembers the orders (and bases) in time of the component spaces in new order (and basis) arrays]
     '''
 
     # Create mixed function space
     new = functionspace.MixedFunctionSpace(spaces, name=None, mesh=None)
 
-    # Sore orders
+    # Store orders, bases and layouts
     new.order = []
+    new.basis = []
+    new.layout = []
     for space in spaces:
         new.order += space.order
+        new.basis += space.basis
+        new.layout += _layouts(space)
 
     return new
 
@@ -83,15 +266,25 @@ def FETsplit(v):
     [DOCUMENTATION GOES HERE]
     '''
 
-    # Split
-    sub_functions_long = split_functions.split(v)
+    # Split (A single space with interleaved layout is not mixed, so is its own only part)
+    space = v.function_space()
+    if len(space.order) == 1 and _layouts(space)[0] == "interleaved":
+        sub_functions_long = (v,)
+    else:
+        sub_functions_long = split_functions.split(v)
 
     # Regroup the different orders for functions of the same function space
     sub_functions_short = []
     order_sum = 0
-    for order_ in v.function_space().order:
-        sub_functions_short.append(tuple(sub_functions_long[order_sum:(order_sum+order_+1)]))
-        order_sum += order_+1
+    for (order_, basis_, layout_) in zip(space.order, space.basis, _layouts(space)):
+        # (Extracting the coefficients in time from the final value dimension if interleaved)
+        affine = types.SimpleNamespace(function=v, field=len(sub_functions_short), tmat=numpy.eye(order_+1), offset=[None]*(order_+1))
+        if layout_ == "interleaved":
+            sub_functions_short.append(FETList([_FETcomponent(sub_functions_long[order_sum], i) for i in range(order_+1)], basis_, affine))
+            order_sum += 1
+        else:
+            sub_functions_short.append(FETList(sub_functions_long[order_sum:(order_sum+order_+1)], basis_, affine))
+            order_sum += order_+1
 
     return tuple(sub_functions_short)
 
@@ -103,55 +296,67 @@ def FETsplit(v):
 
 
 
-def integrate(u_t, u_IC, timestep):
+def integrate(u_t, u_IC, timestep, literal=False):
     '''
     [DOCUMENTATION GOES HERE]
 
     [Loosely: Takes a cheb_fet list for du/dt, and returns a cheb_fet list for u]
+
+    [literal: If True, coefficients enter the output as literals, folded into the compiled kernels (So fewer kernel arguments, but any change to their values, e.g. to timestep, compiles new kernels); if False (default), as Constants]
     '''
 
     # Normalise input
     timestep = float(timestep)
 
-    # Create output, elementwise on input
-    u = [u_IC]
-    for i, u_t_ in enumerate(u_t):
-        if i == 0:
-            u[0]   = u[0]   + constant.Constant(timestep/2) * u_t_
-            u     +=         [constant.Constant(timestep/2) * u_t_]
-        elif i == 1:
-            u[0]   = u[0]   - constant.Constant(timestep/2 * 1/4) * u_t_
-            u     +=         [constant.Constant(timestep/2 * 1/4) * u_t_]
-        else:
-            u[0]   = u[0]   - constant.Constant(timestep/2 * (-1)**i * 1/(i**2-1)) * u_t_
-            u[i-1] = u[i-1] - constant.Constant(timestep/2 * 1/2/(i-1)) * u_t_
-            u     +=         [constant.Constant(timestep/2 * 1/2/(i+1)) * u_t_]
+    # Retrieve integrals from -1 of the basis functions
+    basis = _basis(u_t)
+    intmat = _basis_tables(basis).intmat(len(u_t)-1)
+
+    # Create output, elementwise on output
+    u = []
+    for (k, intmat_) in enumerate(intmat):
+        u_ = u_IC if k == 0 else 0
+        for (coeff, u_t_) in zip(intmat_, u_t):
+            if coeff != 0:
+                u_ = u_ + _coefficient(timestep/2 * coeff, literal) * u_t_
+        u += [u_]
+
+    # Track affine dependence
+    offset = [None]*len(intmat)
+    if not (isinstance(u_IC, numbers.Number) and u_IC == 0):
+        offset[0] = u_IC
+    affine = _FETaffine(getattr(u_t, "affine", None), timestep/2 * intmat, offset)
 
-    return tuple(u)
+    return FETList(u, basis, affine)
 
 
 
-def project(u, tol = 1e-15):
+def project(u, tol = 1e-15, literal=False):
     '''
     [DOCUMENTATION GOES HERE]
 
     [Loosely: Evaluates the L^2 projection of u into the polynomial space of 1 lower order]
+
+    [literal: As in integrate]
     '''
-    # Evaluate order of u
+    # Evaluate order and basis of u
     order = len(u)-1
+    basis = _basis(u)
 
     # Evaluate projection of highest order polnoymial
-    coeff = cheb_plus.chebprojvec(order-1, order)
+    coeff = _basis_tables(basis).projmat(order-1, order)[order]
     
-    # Create output, element-wise on output
+    # Create output, element-wise on output (And the matrix of the map)
     out = []
-    for (u_, coeff_) in zip(u, coeff):
+    mat = numpy.eye(order, order+1)
+    for (k, (u_, coeff_)) in enumerate(zip(u, coeff)):
         if abs(coeff_) >= tol:
-            out += [u_ + constant.Constant(coeff_)*u[order]]
+            out += [u_ + _coefficient(coeff_, literal)*u[order]]
+            mat[k, order] = coeff_
         else:
             out += [u_]
 
-    return tuple(out)
+    return FETList(out, basis, _FETaffine(getattr(u, "affine", None), mat))
 
 
 
@@ -161,75 +366,478 @@ def project(u, tol = 1e-15):
 
 
 
-def residual(F, res, input, poly=True, leg_pts=None, tol=1e-15):
+def _FETcombine(u, coeff, tol=0.0, literal=False):
+    # Evaluate the linear combination sum_i coeff[i]*u[i] of the components of a cheb_fet list
+    # (Skipping coefficients smaller than tol, and returning None if all are)
+    out = None
+    for (coeff_, u_) in zip(coeff, u):
+        if abs(coeff_) >= tol:
+            if out is None:
+                out = _coefficient(coeff_, literal)*u_
+            else:
+                out = out + _coefficient(coeff_, literal)*u_
+
+    return out
+
+
+
+def _FETslot(u, coeff, tol=0.0):
+    # Dependence of the linear combination sum_i coeff[i]*u[i] (As evaluated by _FETcombine) on the coefficients in time w of a field, as a namespace with attributes affine and coeff, for the combination offset + coeff @ w (Or None if it is not known)
+    affine = getattr(u, "affine", None)
+    if affine is None:
+        return None
+
+    coeff = numpy.asarray(coeff, dtype=float)
+    return types.SimpleNamespace(affine=affine, coeff=numpy.where(abs(coeff) >= tol, coeff, 0.0) @ affine.tmat)
+
+
+
+def _FETterm(F, res, args, slots, tol=0.0, calls=None):
+    # Add the term res(*args) to F (Recording, if F is a ResidualBuilder, the dependence of each argument, from _FETslot, and res in placeholder arguments, from _FETcall, for FETjacobian)
+    form = res(*args)
+    if isinstance(F, ResidualBuilder):
+        return F.add(form, term=types.SimpleNamespace(args=args, slots=slots, tol=tol, form=form, call=_FETcall(res, slots, {} if calls is None else calls)))
+
+    return F + form
+
+
+
+def _FETcall(res, slots, calls):
+    # Evaluate res in placeholder arguments in the spatial function space of each slot, now (So that any variables res closes over take their current values), as a namespace shared through calls by the terms of one call of residual
+    # (Returning None if the term cannot be replayed by FETjacobian)
+    if any(slot is None or _layouts(slot.affine.function.function_space())[slot.affine.field] == "interleaved" for slot in slots):
+        return None
+
+    spaces = [_FETspatial(slot.affine.function.function_space(), slot.affine.field) for slot in slots]
+    key = tuple(id(space) for space in spaces)
+    if key not in calls:
+        placeholders = [Coefficient(space) for space in spaces]
+        calls[key] = types.SimpleNamespace(placeholders=placeholders, form=res(*placeholders), jacobians={})
+
+    return calls[key]
+
+
+
+def _balanced_sum(terms):
+    # Sum a list of expressions pairwise, so that the depth of the resulting expression tree grows logarithmically in its length
+    while len(terms) > 1:
+        terms = [sum(terms[i:i+2][1:], terms[i]) for i in range(0, len(terms), 2)]
+
+    return terms[0]
+
+
+
+# Partitions of residuals into parts compiled and assembled separately
+partitions = ["block", "term"]
+
+
+
+class ResidualBuilder:
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: Accumulates a residual term by term (Via F += form, e.g. as F in residual), and materialises it as a single Form via form(), with one integral per measure]
+
+    [Adding Forms directly copies the integral list on every addition, so costs quadratic time in the no. of terms]
+
+    [Also holds any Kronecker-structured and linear terms (See residual), which are kept out of form(), and must be solved for with solve]
+
+    [Also records how each ordinary term added by residual was built, so that FETjacobian can differentiate it term-wise]
+    '''
+
+    def __init__(self):
+        # Integrals, grouped by measure (Integral type, domain, subdomain, metadata and subdomain data), for ordinary and linear terms
+        self._integrals = {}
+        self._linear_integrals = {}
+
+        # Kronecker-structured terms
+        self.kron_terms = []
+
+        # Assembled space-time matrix of the Kronecker-structured and linear terms (With the values of the Constants it was assembled with), per unknown
+        self._linear = {}
+
+        # Solvers, per unknown, Jacobian, solver parameters and partition
+        self._solvers = {}
+
+        # Ordinary terms added by residual (With the dependence of their arguments on the unknown), and any other forms, for FETjacobian
+        self._terms = []
+        self._forms = []
+
+    def add(self, form, linear=False, term=None):
+        if not linear:
+            if term is None:
+                self._forms.append(form)
+            else:
+                self._terms.append(term)
+
+        integrals_dict = self._linear_integrals if linear else self._integrals
+        for integral in form.integrals():
+            key = (
+                integral.integral_type(),
+                integral.ufl_domain(),
+                integral.subdomain_id(),
+                repr(sorted(integral.metadata().items())),
+                id(integral.subdomain_data()),
+            )
+            integrals_dict.setdefault(key, []).append(integral)
+
+        return self
+
+    def __iadd__(self, form):
+        return self.add(form)
+
+    def __len__(self):
+        return sum(len(integrals) for integrals in self._integrals.values())
+
+    def form(self, linear=False):
+        # Sum integrands sharing a measure into a single integral
+        return Form([
+            integrals[0].reconstruct(integrand=_balanced_sum([integral.integrand() for integral in integrals]))
+            for integrals in (self._linear_integrals if linear else self._integrals).values()
+        ])
+
+    def _linear_state(self, u):
+        # Retrieve the Jacobian and offset (The part independent of u, or None if there is none) of the linear terms as functions of u (Built on first use)
+        if id(u) not in self._linear:
+            linear_form = self.form(linear=True)
+            offset = replace(linear_form, {u: Zero(u.ufl_shape)}) if linear_form.integrals() else None
+            self._linear[id(u)] = types.SimpleNamespace(
+                jacobian = ufl_expr.derivative(linear_form, u) if linear_form.integrals() else None,
+                offset = offset if offset is not None and offset.integrals() else None,
+                offset_vec = None,
+                mat = None,
+                values = None,
+            )
+
+        return self._linear[id(u)]
+
+    def linearmat(self, u):
+        # Retrieve the space-time matrix of the Kronecker-structured and linear terms, as functions of u (Reassembling if the value of any Constant in them has changed)
+        state = self._linear_state(u)
+        values = _constant_values([term.form for term in self.kron_terms] + ([state.jacobian] if state.jacobian is not None else []))
+
+        if state.mat is None or not all(numpy.array_equal(a, b) for (a, b) in zip(values, state.values)):
+            mat = _FETkronmat(self.kron_terms) if self.kron_terms else None
+            if state.jacobian is not None:
+                jacobian_mat = assemble(state.jacobian, mat_type="aij").petscmat.copy()
+                if mat is None:
+                    mat = jacobian_mat
+                else:
+                    mat.axpy(1.0, jacobian_mat, structure=PETSc.Mat.Structure.DIFFERENT_NONZERO_PATTERN)
+                    jacobian_mat.destroy()
+
+            # (Freeing the previous matrix, as PETSc objects are destroyed collectively, not by the garbage collector)
+            if state.mat is not None:
+                state.mat.destroy()
+            (state.mat, state.values) = (mat, values)
+
+        return state.mat
+
+    def linear_offset(self, u):
+        # Assemble the part of the linear terms independent of u (Returning None if there is none)
+        state = self._linear_state(u)
+        if state.offset is None:
+            return None
+
+        state.offset_vec = assemble(state.offset, tensor=state.offset_vec)
+
+        return state.offset_vec
+
+    def partition(self, by="block", parts=None):
+        # Split the ordinary terms into several ResidualBuilders: by the field of their test function ("block"), or into parts groups of consecutive terms ("term", default: one per CPU)
+        # (Terms not added by residual form one further part)
+        if by == "block":
+            keys = [None if term.slots[-1] is None else term.slots[-1].affine.field for term in self._terms]
+        elif by == "term":
+            parts = os.cpu_count() if parts is None else parts
+            keys = [k*parts // len(self._terms) for k in range(len(self._terms))]
+        else:
+            raise ValueError(f"Unknown partition '{by}': must be one of {partitions}")
+
+        out = {}
+        for (key, term) in zip(keys, self._terms):
+            out.setdefault(key, ResidualBuilder()).add(term.form, term=term)
+        out = list(out.values())
+
+        if self._forms:
+            out.append(ResidualBuilder())
+            for form in self._forms:
+                out[-1] += form
+
+        return out
+
+
+
+def _FETcombinations(u_tup, shape, symmetric=False):
+    # Generate all combinations of indices into the cheb_fet lists u_tup, with their multiplicities
+    # (If symmetric, repeated lists are combined in non-decreasing order only, with multiplicity the number of orderings)
+    if not symmetric:
+        for ind in numpy.ndindex(*shape):
+            yield (ind, 1)
+        return
+
+    # Group positions of repeated lists
+    groups = []
+    for (k, u) in enumerate(u_tup):
+        for group in groups:
+            if u_tup[group[0]] is u:
+                group.append(k)
+                break
+        else:
+            groups.append([k])
+
+    # Generate combinations group-wise
+    for group_ind_comb in itertools.product(*[
+        itertools.combinations_with_replacement(range(shape[group[0]]), len(group))
+        for group in groups
+    ]):
+        ind = [None]*len(u_tup)
+        multiplicity = 1
+        for (group, group_ind) in zip(groups, group_ind_comb):
+            for (k, i) in zip(group, group_ind):
+                ind[k] = i
+            multiplicity *= math.factorial(len(group_ind))
+            for count in collections.Counter(group_ind).values():
+                multiplicity //= math.factorial(count)
+
+        yield (tuple(ind), multiplicity)
+
+
+
+def _exact_leg_pts(orders):
+    # Minimal no. of Gauss--Legendre points integrating a product of polynomials of the given degrees exactly
+    return (sum(orders) + 2) // 2
+
+
+
+# Record of the no. of Gauss--Legendre points chosen by leg_pts="adaptive"
+leg_pts_log = []
+
+
+
+def _adaptive_leg_pts(term, u_tup, v, tables, quad_tol, max_leg_pts):
+    # Choose the no. of Gauss--Legendre points for term(*u_input, v_input) (A 0-form), as the smallest for which the next rule agrees to quad_tol (relative), on the current values of the inputs
+    # (v=None if term has no test function; max_leg_pts if the inputs are currently constant in time, e.g. an initial guess repeating the initial condition, as every rule then agrees)
+
+    # 1. Represent the coefficients at a point by Constants, so that every rule shares a single compiled form...
+    u_coeff = [[constant.Constant(0.0) for _ in u] for u in u_tup]
+    u_input = [sum(c_*u_ for (c_, u_) in zip(c, u)) for (c, u) in zip(u_coeff, u_tup)]
+    if v is None:
+        v_coeff = []
+        form = term(*u_input)
+    else:
+        v_coeff = [constant.Constant(0.0) for _ in v]
+        form = term(*u_input, sum(c_*v_ for (c_, v_) in zip(v_coeff, v)))
+
+        # (Replacing the test function by a fixed, generic function)
+        test = form.arguments()[0]
+        w = function.Function(test.function_space())
+        rng = numpy.random.default_rng(0)
+        for dat in w.dat:
+            dat.data[:] = rng.uniform(-1, 1, dat.data.shape)
+        form = replace(form, {test: w})
+
+    # 2. ...Check the inputs currently vary in time, if they can (Some component other than the first, constant, one being non-zero)...
+    variation = [u_ for u in u_tup for u_ in u[1:] if not (isinstance(u_, numbers.Number) and u_ == 0)]
+    if all(len(u) == 1 for u in u_tup) or any(isinstance(u_, numbers.Number) for u_ in variation):
+        varies = True
+    else:
+        variation = sum(inner(u_, u_) for u_ in variation)
+        varies = not isinstance(variation, numbers.Number) and float(assemble(variation*Measure("dx", domain=form.ufl_domain()))) > 0
+
+    # 3. ...Evaluate the rule with a given no. of points...
+    def quad(leg_pts):
+        vander = [tables.leggauss(len(u)-1, leg_pts)[2] for u in u_tup]
+        if v is None:
+            weight = tables.leggauss(0, leg_pts)[1][:, None]
+        else:
+            weight = tables.dualweights(len(v)-1, leg_pts)
+
+        out = 0.0
+        for q in range(leg_pts):
+            for (c, vander_) in zip(u_coeff + [v_coeff], vander + [weight]):
+                for (c_, val) in zip(c, vander_[q]):
+                    c_.assign(float(val))
+            out += (weight[q, 0] if v is None else 1.0) * float(assemble(form))
+
+        return out
+
+    # 4. ...And refine, starting from the no. of points exact for the polynomial degrees of the inputs (Or fall back to max_leg_pts, with an unknown error, if the inputs are constant in time)
+    leg_pts = _exact_leg_pts([len(u)-1 for u in u_tup] + ([] if v is None else [len(v)-1]))
+    if varies:
+        quad_curr = quad(leg_pts)
+        error = 0.0
+        while leg_pts < max_leg_pts:
+            quad_next = quad(leg_pts + 1)
+            error = abs(quad_next - quad_curr)
+            if error <= quad_tol * abs(quad_next):
+                break
+            (leg_pts, quad_curr) = (leg_pts + 1, quad_next)
+    else:
+        (leg_pts, error) = (max(leg_pts, max_leg_pts), math.nan)
+
+    # Report choice
+    code = term.__code__
+    leg_pts_log.append((f"{code.co_filename}:{code.co_firstlineno}", leg_pts, float(error)))
+
+    return leg_pts
+
+
+
+def residual(F, res, input, poly=True, leg_pts=None, tol=1e-15, symmetric=False, quad_tol=1e-10, max_leg_pts=None, literal=False, kron=False, linear=False):
     '''
     [DOCUMENTATION GOES HERE]
 
     [Loosely: Takes in a residual F and a new a residual component lambda(input), and evaluates the incremented residual over the input cheb_fet lists]
+
+    [F may be 0, a Form, or a ResidualBuilder (Which is incremented in place, and is preferable when there are many terms)]
+
+    [res must be linear in its final (test function) argument: contributions to each component of the test function are combined before res is called]
+
+    [symmetric: If True, res must be symmetric in any inputs that are repeated (e.g. a, b in lambda a, b, c : a*b*c with input (u, u, v)); each unordered combination of their components is then added only once, with the summed coefficient (poly=True only)]
+
+    [leg_pts: No. of Gauss--Legendre points in time (poly=False only); "exact" picks the fewest points integrating res exactly when it is polynomial in its inputs (i.e. ceil((sum of orders + 1)/2)), giving the same residual as poly=True with one res term per point instead of one per index combination]
+
+    [leg_pts="adaptive": Picks the fewest points (no fewer than for "exact", no more than max_leg_pts, default order + 10) for which the next rule agrees to relative tolerance quad_tol, tested on the current values of the inputs (e.g. an initial guess) with the test function replaced by a fixed function; if the inputs are then constant in time (e.g. an initial guess repeating the initial condition), every rule agrees and the test says nothing, so max_leg_pts points are used, with error estimate nan; each choice is appended to leg_pts_log as (location of res, leg_pts, error estimate)]
+
+    [literal: As in integrate]
+
+    [kron: If True, declares the term Kronecker-structured: input is (u, v), with u affine in the coefficients in time w of a field of the unknown (e.g. from FETsplit, integrate and project), and res(u, v) is bilinear and otherwise depends only on Constants and fixed functions. The term is then (coupling matrix in time) x (spatial matrix) acting on w, plus the contribution of the offset of u; F must be a ResidualBuilder, which assembles the spatial matrix once (And again only when a Constant changes), and the residual must be solved for with solve; for fields with interleaved layout, the coupling in time is built into the spatial form instead, assembled once per block]
+
+    [linear: If True, declares the term affine in the unknown, with a Jacobian depending only on Constants and fixed functions (Any other dependence, e.g. on the previous timestep, must be in parts independent of the unknown). F must be a ResidualBuilder, which assembles the Jacobian of all such terms once (And again only when a Constant changes), and adds it to the freshly assembled nonlinear part at each iteration; the residual must be solved for with solve]
+
     '''
 
-    # Retrieve functions and order in time
+    # Evaluations of res in placeholder arguments, shared by the terms of this call (See _FETcall)
+    calls = {}
+
+    # Build linear terms separately
+    if linear:
+        if not isinstance(F, ResidualBuilder):
+            raise ValueError("Linear terms must be added to a ResidualBuilder")
+
+        return F.add(
+            residual(ResidualBuilder(), res, input, poly, leg_pts, tol, symmetric, quad_tol, max_leg_pts, literal).form(),
+            linear=True
+        )
+
+    # Retrieve functions, and order and basis in time
     u_tup = input[0:len(input)-1]
     v     = input[-1]
     order = len(v)-1
-
-    if poly:
-        # Create a list to store enumeration objects for each u
-        u_enum = [enumerate(u) for u in u_tup]
+    tables = _basis_tables(_basis(*input))
+
+    if kron:
+        # Check term
+        if not isinstance(F, ResidualBuilder):
+            raise ValueError("Kronecker-structured terms must be added to a ResidualBuilder")
+        if len(u_tup) != 1 or getattr(u_tup[0], "affine", None) is None or getattr(v, "affine", None) is None:
+            raise ValueError("Kronecker-structured terms must have input (u, v), with u and v affine in the coefficients in time of a field")
+        (u,) = u_tup
+        if any(offset is not None for offset in v.affine.offset):
+            raise ValueError("Kronecker-structured terms must have a test function v with no offset")
+
+        # Retrieve L^2 projections into P^order of every basis function...
+        proj = tables.mulprojtensor([len(u)-1], order, tol)
+        # ...And compose with the dependence of u and v on the coefficients in time of their fields
+        coeff = v.affine.tmat.T @ proj.T @ u.affine.tmat
+        coeff = numpy.where(abs(coeff) >= tol, coeff, 0.0)
+
+        # Store term, with its spatial form(s)
+        (u_space, v_space) = [affine.function.function_space() for affine in [u.affine, v.affine]]
+        (u_layout, v_layout) = [_layouts(affine.function.function_space())[affine.field] for affine in [u.affine, v.affine]]
+        (U, V) = (
+            ufl_expr.TrialFunction(_FETspatial(u_space, u.affine.field)),
+            ufl_expr.TestFunction(_FETspatial(v_space, v.affine.field))
+        )
+        term = types.SimpleNamespace(
+            function = u.affine.function,
+            u_space = u_space,
+            v_space = v_space,
+            u_block = _FETblock(u_space, u.affine.field),
+            v_block = _FETblock(v_space, v.affine.field),
+        )
+
+        if u_layout == "block" and v_layout == "block":
+            # (One spatial form, with a block per pair of coefficients in time)
+            F.kron_terms.append(types.SimpleNamespace(**vars(term), form=res(U, V), coeff=coeff))
+        else:
+            # (With coefficients in time interleaved, the coupling in time is built into the spatial form of their single block)
+            u_parts = [[j] for j in range(coeff.shape[1])] if u_layout == "block" else [list(range(coeff.shape[1]))]
+            v_parts = [[i] for i in range(coeff.shape[0])] if v_layout == "block" else [list(range(coeff.shape[0]))]
+            for (i_block, v_part) in enumerate(v_parts):
+                for (j_block, u_part) in enumerate(u_parts):
+                    forms = [
+                        _coefficient(coeff[i, j], literal) * res(
+                            _FETcomponent(U, j) if u_layout == "interleaved" else U,
+                            _FETcomponent(V, i) if v_layout == "interleaved" else V
+                        )
+                        for i in v_part
+                        for j in u_part
+                        if coeff[i, j] != 0
+                    ]
+                    if forms:
+                        F.kron_terms.append(types.SimpleNamespace(
+                            **{**vars(term), "u_block": term.u_block + j_block, "v_block": term.v_block + i_block},
+                            form = sum(forms[1:], forms[0]),
+                            coeff = numpy.ones((1, 1)),
+                        ))
+
+        # Add contributions of offset as ordinary terms
+        for (proj_, offset) in zip(proj, u.affine.offset):
+            if offset is not None:
+                v_comb = _FETcombine(v, proj_, tol, literal)
+                if v_comb is not None:
+                    F = _FETterm(F, res, (offset, v_comb), [_FETslot(u, numpy.zeros(len(u))), _FETslot(v, proj_, tol)], tol, calls)
+    elif poly:
+        # Retrieve L^2 projections into P^order of the products of every combination of basis functions
+        mul_proj = tables.mulprojtensor([len(u)-1 for u in u_tup], order, tol)
 
         # Generate all possible combinations of inputs
-        for u_enum_comb in itertools.product(*u_enum):
-            # 1. Create array of Chebyshev basis vectors for each given order...
-            basis_vec_arr = [cheb_plus.basis_vec(order) for (order, _) in u_enum_comb]
-            # 2. ...Evaluate product of basis vectors in Chebyshev basis...
-            mul_vec = cheb_plus.chebmulrec(*basis_vec_arr)
-            # 3. ...Take L^2 projection into P^order
-            mul_vec_proj = cheb_plus.chebproj(order, mul_vec)
-
-            # Add contribution at each degree in the test function
-            for (coeff, v_) in zip(mul_vec_proj, v):
-                # (But only if the corresponding coefficient is sufficiently large)
-                if abs(coeff) >= tol:
-                    F += constant.Constant(coeff)*res(*[u_ for (_, u_) in u_enum_comb], v_)
+        for (ind, multiplicity) in _FETcombinations(u_tup, mul_proj.shape[:-1], symmetric):
+            # Combine the contributions at each degree in the test function, by linearity...
+            # (But only those whose corresponding coefficient is sufficiently large)
+            v_comb = _FETcombine(v, multiplicity*mul_proj[ind], tol, literal)
+            # ...And add them
+            if v_comb is not None:
+                F = _FETterm(
+                    F,
+                    res,
+                    [u[i] for (u, i) in zip(u_tup, ind)] + [v_comb],
+                    [_FETslot(u, numpy.eye(len(u))[i]) for (u, i) in zip(u_tup, ind)] + [_FETslot(v, multiplicity*mul_proj[ind], tol)],
+                    tol,
+                    calls
+                )
     else:
         # Get Gauss--Legendre points (Set no. of Gauss--Legendre points if not already set)
         if leg_pts == None:
             leg_pts = order + 10
-        (pt, weight) = numpy.polynomial.legendre.leggauss(leg_pts)
-      
-        # Retrieve information on dual basis
-        dualmat = cheb_plus.chebdualmat(order)
+        elif leg_pts == "exact":
+            leg_pts = _exact_leg_pts([len(u)-1 for u in u_tup] + [order])
+        elif leg_pts == "adaptive":
+            leg_pts = _adaptive_leg_pts(res, u_tup, v, tables, quad_tol, order + 10 if max_leg_pts == None else max_leg_pts)
+
+        # Retrieve values of each basis function at each Gauss--Legendre point...
+        vander = [tables.leggauss(len(u)-1, leg_pts)[2] for u in u_tup]
+        # ...And the weights for the dual basis there
+        dualweights = tables.dualweights(order, leg_pts)
 
         # Add residual at each Gauss--Legendre point:
-        for (pt_, weight_) in zip(pt, weight):
+        for q in range(leg_pts):
             # Evaluate each u at given point
-            u_input = []
-            # For each u:
-            for u in u_tup:
-                # 1. Construct array of basis vectors...
-                basis_vec_arr = [cheb_plus.basis_vec(i) for i in range(len(u))]
-                # 2. ...Evaluate each Chebyshev function at given Gauss--Legendre point...
-                coeff = [cheb_plus.chebval(pt_, basis_vec) for basis_vec in basis_vec_arr]
-                # 3. ...Add corresponding contributions from each u component
-                for (i, (coeff_, u_)) in enumerate(zip(coeff, u)):
-                    if i == 0:
-                        u_input    +=              [constant.Constant(float(coeff_))*u_]
-                    else:
-                        u_input[-1] = u_input[-1] + constant.Constant(float(coeff_))*u_
-            
-            # Evaluate v at given point
-            # 1. Construct array of basis vectors...
-            basis_vec_arr = [cheb_plus.basis_vec(i) for i in range(order+1)]
-            # 2. ...Evaluate each Chebyshev function at given Gauss--Legendre point...
-            coeff = [cheb_plus.chebval(pt_, basis_vec) for basis_vec in basis_vec_arr]
-            # 3. ...Convert to dual basis...
-            coeff_dual = numpy.dot(dualmat, coeff)
-            # 4. ...Add corresponding contributions from each v component to residual
-            for (i, (coeff_dual_, v_)) in enumerate(zip(coeff_dual, v)):
-                F += (
-                    constant.Constant(float(weight_))
-                  * constant.Constant(float(coeff_dual_))
-                  * res(*u_input, v_)
+            u_input = [_FETcombine(u, vander_[q], literal=literal) for (u, vander_) in zip(u_tup, vander)]
+
+            # Combine corresponding contributions from each v component, by linearity...
+            v_comb = _FETcombine(v, dualweights[q], tol, literal)
+            # ...And add them to residual
+            if v_comb is not None:
+                F = _FETterm(
+                    F,
+                    res,
+                    u_input + [v_comb],
+                    [_FETslot(u, vander_[q]) for (u, vander_) in zip(u_tup, vander)] + [_FETslot(v, dualweights[q], tol)],
+                    tol,
+                    calls
                 )
 
     return F
@@ -237,78 +845,411 @@ def residual(F, res, input, poly=True, leg_pts=None, tol=1e-15):
 
 
 '''
-[Loosely: Scripts for assembling output data over space-time intervals]
+[Loosely: Scripts for Kronecker-structured terms, and for solving]
 '''
 
 
 
-def FETassemble(form, input, timestep, poly=True, leg_pts=None, tol=1e-15):
+def _constant_values(forms):
+    # Record the values of the Constants in forms
+    return [
+        numpy.array(c.dat.data_ro)
+        for form in forms
+        for c in list(form.coefficients()) + list(getattr(form, "constants", tuple)())
+        if isinstance(c, constant.Constant)
+    ]
+
+
+
+def _FETkronmat(terms):
+    # Assemble the space-time matrix of Kronecker-structured terms, as a PETSc AIJ matrix in the global numbering of the (mixed) function spaces
+    (u_space, v_space) = (terms[0].u_space, terms[0].v_space)
+
+    # 1. Assemble each spatial matrix, and add its multiples to the corresponding blocks...
+    blocks = [[None for _ in range(len(u_space))] for _ in range(len(v_space))]
+    for term in terms:
+        mat = assemble(term.form, mat_type="aij").petscmat
+        for ((i, j), coeff) in numpy.ndenumerate(term.coeff):
+            if coeff != 0:
+                block = blocks[term.v_block + i][term.u_block + j]
+                if block is None:
+                    block = mat.copy()
+                    block.scale(coeff)
+                    blocks[term.v_block + i][term.u_block + j] = block
+                else:
+                    block.axpy(coeff, mat, structure=PETSc.Mat.Structure.DIFFERENT_NONZERO_PATTERN)
+
+    # 2. ...And combine them (Freeing the blocks and the nest once converted)
+    nest = PETSc.Mat().createNest(
+        blocks,
+        isrows=v_space.dof_dset.field_ises,
+        iscols=u_space.dof_dset.field_ises,
+        comm=u_space.comm
+    )
+    out = nest.convert("aij")
+    nest.destroy()
+    for block in itertools.chain(*blocks):
+        if block is not None:
+            block.destroy()
+
+    return out
+
+
+
+def _linear_callbacks(F, u, parts=()):
+    # Callbacks adding the Kronecker-structured and linear terms of F, and any further parts (F_k, J_k) of its residual and Jacobian, to the residual and Jacobian assembled by a NonlinearVariationalSolver
+
+    # Jacobians whose sparsity pattern has been extended to include the terms
+    extended = set()
+
+    # Assembled residuals and Jacobians of the parts (Reused between assemblies)
+    vecs = [None for _ in parts]
+    mats = [None for _ in parts]
+
+    def post_function_callback(X, F_vec):
+        if F.kron_terms or F._linear_integrals:
+            F.linearmat(u).multAdd(X, F_vec, F_vec)
+            offset = F.linear_offset(u)
+            if offset is not None:
+                with offset.dat.vec_ro as offset_vec:
+                    F_vec.axpy(1.0, offset_vec)
+
+        for (k, (F_k, _)) in enumerate(parts):
+            vecs[k] = assemble(F_k, tensor=vecs[k])
+            with vecs[k].dat.vec_ro as vec:
+                F_vec.axpy(1.0, vec)
+
+    def post_jacobian_callback(X, J):
+        mat_list = [F.linearmat(u)] if F.kron_terms or F._linear_integrals else []
+        for (k, (_, J_k)) in enumerate(parts):
+            if J_k is not None:
+                mats[k] = assemble(J_k, tensor=mats[k], mat_type="aij")
+                mat_list.append(mats[k].petscmat)
+
+        if J.handle in extended:
+            for mat in mat_list:
+                J.axpy(1.0, mat, structure=PETSc.Mat.Structure.SUBSET_NONZERO_PATTERN)
+        else:
+            # The first time (Before the first factorisation), sum into a copy of J with the merged sparsity pattern...
+            merged = J.duplicate(copy=True)
+            for mat in mat_list:
+                merged.axpy(1.0, mat, structure=PETSc.Mat.Structure.DIFFERENT_NONZERO_PATTERN)
+            # ...And preallocate J with it, in place (Keeping the local-to-global maps of J, and with new nonzeros an error again, as assembled)
+            J.setPreallocationCSR(merged.getValuesCSR())
+            J.setOption(PETSc.Mat.Option.NEW_NONZERO_ALLOCATION_ERR, True)
+            merged.destroy()
+            extended.add(J.handle)
+
+    return {"post_function_callback": post_function_callback, "post_jacobian_callback": post_jacobian_callback}
+
+
+
+def _FETjacobian_term(term, u, du_split):
+    # Build the Jacobian of a term recorded by residual in the direction du, by replaying the Jacobian of res in placeholder arguments
+    # (Returning False if the term cannot be replayed, and None if its Jacobian is zero)
+
+    # 1. Check the term can be replayed, and whether each argument depends on u...
+    call = term.call
+    if call is None:
+        return False
+    dependent = [slot.affine.function is u for slot in term.slots[:-1]] + [False]
+    if not any(dependent):
+        return None
+
+    # 2. ...Differentiate res in placeholder arguments, if not already differentiated (Once per call of residual)...
+    if tuple(dependent) not in call.jacobians:
+        directions = [Coefficient(p.ufl_function_space()) if dependent_ else None for (p, dependent_) in zip(call.placeholders, dependent)]
+        derivatives = [derivative(call.form, p, d) for (p, d) in zip(call.placeholders, directions) if d is not None]
+        call.jacobians[tuple(dependent)] = (directions, expand_derivatives(sum(derivatives[1:], derivatives[0])))
+    (directions, jacobian) = call.jacobians[tuple(dependent)]
+
+    # 3. ...And substitute the arguments of the term, and their derivatives in the direction du
+    mapping = {}
+    for (p, d, arg, slot) in zip(call.placeholders, directions, term.args, term.slots):
+        mapping[p] = Zero(p.ufl_shape) if isinstance(arg, numbers.Number) and arg == 0 else as_ufl(arg)
+        if d is not None:
+            direction = _FETcombine(du_split[slot.affine.field], slot.coeff, term.tol)
+            mapping[d] = Zero(d.ufl_shape) if direction is None else direction
+
+    return replace(jacobian, mapping)
+
+
+
+def FETjacobian(F, u):
     '''
     [DOCUMENTATION GOES HERE]
 
-    [Loosely: Takes in a form lambda(input), and assembles its value integrated over the previous timestep]
+    [Loosely: Takes in a residual F and the function u it is to be solved for, and returns (F, J), with J the Jacobian of F with respect to u (As from derivative)]
+
+    [For a ResidualBuilder, each term added by residual is differentiated by differentiating res once per call of residual, in placeholder arguments (Evaluated when the term is added, so that variables res closes over, e.g. loop variables, take their values then), and replaying the result over the term's combinations (Which avoids differentiating the full residual); other terms (e.g. those added directly, or with inputs that are not affine in the coefficients in time of a field, or with interleaved layout) are differentiated with derivative]
+
+    [As with form(), Kronecker-structured and linear terms are left out of both F and J (They are added by solve); raises ValueError if J has no terms, e.g. if F depends on u only through them]
+    '''
+    (F_form, J) = _FETjacobian(F, u)
+    if not J.integrals():
+        raise ValueError("The Jacobian has no terms: the residual (Without Kronecker-structured and linear terms) does not depend on the function being solved for")
+
+    return (F_form, J)
+
+
+
+def _FETjacobian(F, u):
+    # Build (F, J) as FETjacobian, with J possibly empty (As for a part of a partitioned residual independent of u)
+    # (Derivatives are expanded, so that terms independent of u are dropped)
+
+    # Differentiate forms as usual
+    du = ufl_expr.TrialFunction(u.function_space())
+    if not isinstance(F, ResidualBuilder):
+        return (F, expand_derivatives(ufl_expr.derivative(F, u, du)))
+
+    # Replay the Jacobians of the terms added by residual...
+    du_split = FETsplit(du)
+    out = ResidualBuilder()
+    others = ResidualBuilder()
+    for term in F._terms:
+        jacobian = _FETjacobian_term(term, u, du_split)
+        if jacobian is False:
+            others += term.form
+        elif jacobian is not None:
+            out += jacobian
+
+    # ...And differentiate any other terms
+    for form in F._forms:
+        others += form
+    if len(others) > 0:
+        out += expand_derivatives(ufl_expr.derivative(others.form(), u, du))
+
+    return (F.form(), out.form())
+
+
+
+def _FETproblem(F, u, J=None, partition=None, parts=None):
+    # Build the residual and Jacobian of a ResidualBuilder to be assembled by a solver for u, and the further parts (F_k, J_k) to be added in callbacks (See solve)
+
+    # Check Kronecker-structured terms act on u, and that there is a nonlinear part
+    if any(term.function is not u for term in F.kron_terms):
+        raise ValueError("Kronecker-structured terms must depend on the function being solved for")
+    if not F._integrals:
+        raise ValueError("Residuals must have at least one term that is neither Kronecker-structured nor linear")
+    if partition is not None and J is not None:
+        raise ValueError("The Jacobian of each part of a partitioned residual is built with FETjacobian, so J cannot be given")
+
+    if partition is None:
+        return (F.form(), J, [])
+
+    # 1. Split residual into parts, with their Jacobians (Solving with a part with a non-zero Jacobian first)...
+    part_list = [_FETjacobian(part, u) for part in F.partition(partition, parts)]
+    part_list = [(F_k, J_k if J_k.integrals() else None) for (F_k, J_k) in part_list]
+    part_list.sort(key=lambda part : part[1] is None)
+
+    # 2. ...And solve with the first part, adding the others in callbacks
+    return part_list[0] + (part_list[1:],)
+
+
+
+def _FETsolver(F, u, solver_parameters=None, J=None, partition=None, parts=None):
+    # Create a NonlinearVariationalSolver for F == 0, for F a Form or ResidualBuilder (As used by solve)
+    if not isinstance(F, ResidualBuilder):
+        (F_form, part_list, callbacks) = (F, [], False)
+    else:
+        (F_form, J, part_list) = _FETproblem(F, u, J, partition, parts)
+        callbacks = bool(F.kron_terms or F._linear_integrals or part_list)
+
+    problem = variational_solver.NonlinearVariationalProblem(F_form, u, J=J)
+    return variational_solver.NonlinearVariationalSolver(
+        problem,
+        solver_parameters=solver_parameters,
+        **(_linear_callbacks(F, u, part_list) if callbacks else {})
+    )
+
+
+
+def solve(F, u, solver_parameters=None, J=None, partition=None, parts=None):
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: Solves F == 0 for u, for F a Form or ResidualBuilder; Kronecker-structured and linear terms of a ResidualBuilder are added to the assembled residual and Jacobian (Which must be of type "aij") as a precomputed space-time matrix]
+
+    [The solver for a given ResidualBuilder, u, J and solver_parameters is created once, and reused on later calls (So all terms must be added before the first call)]
+
+    [J: The Jacobian of F (Or of form(), for a ResidualBuilder), e.g. from FETjacobian; if None, it is evaluated with derivative]
+
+    [partition: If "block" or "term", the ordinary terms of a ResidualBuilder are split into parts as by ResidualBuilder.partition (With parts as there), each with its own residual and Jacobian (From FETjacobian, so J must be None), and each part is assembled separately, into the same global vector and matrix; their kernels are compiled on first assembly, and can be compiled ahead of time, in separate processes, with avfet_modules.warmup]
     '''
 
+    # Solve forms, and residuals without Kronecker-structured or linear terms or partitions, as usual
+    if not isinstance(F, ResidualBuilder):
+        return solving.solve(F == 0, u, J=J, solver_parameters=solver_parameters)
+    if not F.kron_terms and not F._linear_integrals and partition is None:
+        return solving.solve(F.form() == 0, u, J=J, solver_parameters=solver_parameters)
+
+    # Create solver, if not already created (Keeping u and J alive, so that their ids are not reused)...
+    key = (id(u), id(J), repr(solver_parameters), partition, parts)
+    if key not in F._solvers:
+        F._solvers[key] = (u, J, _FETsolver(F, u, solver_parameters, J, partition, parts))
+
+    # ...And solve
+    F._solvers[key][2].solve()
+
+
+
+def warmup(F, u, J=None, partition=None, parts=None):
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: Assembles the residual F and its Jacobian with respect to u (With any Kronecker-structured and linear terms, and parts) once, as solve would, but without solving; their kernels are then compiled, and found in the disk caches by later runs]
+
+    [J, partition, parts: As in solve]
+    '''
+
+    # Build residual and Jacobian, as in solve
+    if isinstance(F, ResidualBuilder):
+        (F_form, J, part_list) = _FETproblem(F, u, J, partition, parts)
+        if F.kron_terms or F._linear_integrals:
+            F.linearmat(u)
+            F.linear_offset(u)
+    else:
+        (F_form, part_list) = (F, [])
+
+    # Assemble each
+    for (F_k, J_k) in [(F_form, ufl_expr.derivative(F_form, u) if J is None else J)] + part_list:
+        assemble(F_k)
+        if J_k is not None:
+            assemble(J_k, mat_type="aij")
+
+
+
+'''
+[Loosely: Scripts for assembling output data over space-time intervals]
+'''
+
+
+
+# Choices of leg_pts="adaptive" in FETassemble, per form (The lambda itself, not its code, so closures are told apart) and inputs (Made once, on first assembly)
+_FETassemble_leg_pts = weakref.WeakKeyDictionary()
+
+
+
+def _FETfunctional(form, input, timestep, poly=True, leg_pts=None, tol=1e-15, symmetric=False, quad_tol=1e-10, max_leg_pts=None, literal=False):
+    # Build a single 0-form for the integral of form(input) over the previous timestep (Returning None if it has no contributions)
+
     # Normalise timstep
     timestep = float(timestep)
 
+    # Retrieve basis in time
+    tables = _basis_tables(_basis(*input))
+
     # Create output
-    out = 0
+    out = ResidualBuilder()
 
     if poly:
-        # Create a list to store enumeration objects for each u
-        u_enum = [enumerate(u) for u in input]
+        # Retrieve integrals over [-1, 1] of the products of every combination of basis functions
+        # (Twice the L^2 projection into P^0)
+        mul_int = 2*tables.mulprojtensor([len(u)-1 for u in input], 0)[..., 0]
 
         # Evaluate contributions to output tuple-wise
-        for u_enum_comb in itertools.product(*u_enum):
-            # 1. Create array of Chebyshev basis vectors for each given order...
-            basis_vec_arr = [cheb_plus.basis_vec(order) for (order, _) in u_enum_comb]
-            # 2. ...Evaluate product of basis vectors in Chebyshev basis...
-            mul_vec = cheb_plus.chebmulrec(*basis_vec_arr)
-            # 3. ...Integrate from -1...
-            mul_vec_int = cheb_plus.chebint(mul_vec, lbnd=-1)
-            # 4. ...And evaluate at 1
-            coeff = float(cheb_plus.chebval(1, mul_vec_int))
+        for (ind, multiplicity) in _FETcombinations(input, mul_int.shape, symmetric):
+            coeff = float(multiplicity*mul_int[ind])
             
             # If the result is sufficiently large...
             if abs(coeff) >= tol:
                 # ...Add the contribution to the output
                 out += (
-                    coeff
-                  * timestep/2
-                  * assemble(form(*[u for (_, u) in u_enum_comb]))
+                    _coefficient(coeff * timestep/2, literal)
+                  * form(*[u[i] for (u, i) in zip(input, ind)])
                 )
     else:
         # Get Gauss--Legendre points (Set no. of Gauss--Legendre points if not already set)
         if leg_pts == None:
             leg_pts = (len(input[0]) - 1) + 10
-        (pt, weight) = numpy.polynomial.legendre.leggauss(leg_pts)
+        elif leg_pts == "exact":
+            leg_pts = _exact_leg_pts([len(u)-1 for u in input])
+        elif leg_pts == "adaptive":
+            key = (tuple(tuple(u) for u in input), quad_tol, max_leg_pts)
+            choices = _FETassemble_leg_pts.setdefault(form, {})
+            if key not in choices:
+                choices[key] = _adaptive_leg_pts(form, input, None, tables, quad_tol, (len(input[0]) - 1) + 10 if max_leg_pts == None else max_leg_pts)
+            leg_pts = choices[key]
+
+        # Retrieve Gauss--Legendre weights, and values of each basis function at each Gauss--Legendre point
+        weight = tables.leggauss(0, leg_pts)[1]
+        vander = [tables.leggauss(len(u)-1, leg_pts)[2] for u in input]
 
         # Add residual at each Gauss--Legendre point:
-        for (pt_, weight_) in zip(pt, weight):
+        for (q, weight_) in enumerate(weight):
             # Evaluate each u at given point
-            u_input = []
-            # For each u:
-            for u in input:
-                # 1. Construct array of basis vectors...
-                basis_vec_arr = [cheb_plus.basis_vec(i) for i in range(len(u))]
-                # 2. ...Evaluate each Chebyshev function at given Gauss--Legendre point...
-                coeff = [cheb_plus.chebval(pt_, basis_vec) for basis_vec in basis_vec_arr]
-                # 3. ...Add corresponding contributions from each u component
-                for (i, (coeff_, u_)) in enumerate(zip(coeff, u)):
-                    if i == 0:
-                        u_input    +=              [constant.Constant(float(coeff_))*u_]
-                    else:
-                        u_input[-1] = u_input[-1] + constant.Constant(float(coeff_))*u_
+            u_input = [_FETcombine(u, vander_[q], literal=literal) for (u, vander_) in zip(input, vander)]
             
             # Add residual contribution to output
             out += (
-                    weight_
-                  * timestep/2
-                  * assemble(form(*u_input))
+                    _coefficient(weight_ * timestep/2, literal)
+                  * form(*u_input)
                 )
 
-    return out
+    return out.form() if len(out) > 0 else None
+
+
+
+def FETassemble(form, input, timestep, poly=True, leg_pts=None, tol=1e-15, symmetric=False, quad_tol=1e-10, max_leg_pts=None, literal=False):
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: Takes in a form lambda(input), and assembles its value integrated over the previous timestep]
+
+    [All contributions are combined into a single form, and assembled in a single pass]
+
+    [symmetric, leg_pts, quad_tol, max_leg_pts, literal: As in residual (leg_pts="adaptive" is chosen on the first call for a given form and inputs, and reused thereafter)]
+    '''
+
+    # Build combined form...
+    functional = _FETfunctional(form, input, timestep, poly, leg_pts, tol, symmetric, quad_tol, max_leg_pts, literal)
+
+    # ...And assemble it
+    return 0.0 if functional is None else float(assemble(functional))
+
+
+
+def FETassemble_batch(terms, timestep, **kwargs):
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: Takes in a list of terms (form, input) or (form, input, options), and assembles the value of each integrated over the previous timestep, as in FETassemble, returning a list]
+
+    [All terms are combined into a single form (With the k-th term tested against the k-th component of a vector in the "R" space) and assembled in a single pass]
+
+    [kwargs: Default options for every term (As in FETassemble); options: A dict of options for a particular term, overriding these]
+    '''
+
+    # Build combined form...
+    form = _FETbatch(terms, timestep, **kwargs)
+
+    # ...And assemble it
+    return [0.0 for _ in terms] if form is None else [float(value) for value in assemble(form).dat.data_ro.reshape(-1)]
+
+
+
+def _FETbatch(terms, timestep, **kwargs):
+    # Build the single form of FETassemble_batch (Returning None if it has no contributions)
+
+    # Build combined form for each term
+    functionals = [
+        _FETfunctional(*term[:2], timestep, **{**kwargs, **(term[2] if len(term) > 2 else {})})
+        for term in terms
+    ]
+
+    # Check there is anything to assemble
+    if all(functional is None for functional in functionals):
+        return None
+
+    # Test each term against a component of a vector in the "R" space
+    mesh = next(functional for functional in functionals if functional is not None).ufl_domain()
+    r = ufl_expr.TestFunction(functionspace.VectorFunctionSpace(mesh, "R", 0, dim=len(terms)))
+    out = ResidualBuilder()
+    for (k, functional) in enumerate(functionals):
+        if functional is not None:
+            out += Form([integral.reconstruct(integrand=r[k]*integral.integrand()) for integral in functional.integrals()])
+
+    return out.form()
 
 
 
@@ -318,6 +1259,43 @@ def FETassemble(form, input, timestep, poly=True, leg_pts=None, tol=1e-15):
 
 
 
+def _FETcoefficients(u, k):
+    # Retrieve the coefficients in time of the k-th field of a function in a FET function space
+    space = u.function_space()
+    block = _FETblock(space, k)
+
+    if _layouts(space)[k] == "interleaved":
+        return [_FETcomponent(u.subfunctions[block], i) for i in range(space.order[k]+1)]
+    else:
+        return [u.sub(block + i) for i in range(space.order[k]+1)]
+
+
+
+def _FETdata(u, k):
+    # Retrieve the data of the coefficients in time of the k-th field of a function in a FET function space, as an array indexed first by degree in time
+    space = u.function_space()
+    block = _FETblock(space, k)
+
+    if _layouts(space)[k] == "interleaved":
+        return numpy.moveaxis(u.subfunctions[block].dat.data_ro, -1, 0)
+    else:
+        return numpy.stack([u.subfunctions[block + i].dat.data_ro for i in range(space.order[k]+1)])
+
+
+
+def _FETwrite(u, k, values):
+    # Write the data of the coefficients in time of the k-th field of a function in a FET function space, from an array indexed first by degree in time (As from _FETdata)
+    space = u.function_space()
+    block = _FETblock(space, k)
+
+    if _layouts(space)[k] == "interleaved":
+        u.subfunctions[block].dat.data[:] = numpy.moveaxis(values, 0, -1)
+    else:
+        for (i, value) in enumerate(values):
+            u.subfunctions[block + i].dat.data[:] = value
+
+
+
 def FETeval(u_ind, u_t_ind, t, timestep):
     '''
     [DOCUMENTATION GOES HERE]
@@ -336,29 +1314,294 @@ def FETeval(u_ind, u_t_ind, t, timestep):
     (u_ind_0,   u_ind_1)   = u_ind
     (u_t_ind_0, u_t_ind_1) = u_t_ind
 
-    # Retrieve orders in time
+    # Retrieve orders and bases in time
     order = u_t_ind_0.function_space().order
+    basis = u_t_ind_0.function_space().basis
+
+    # Evaluate integrated basis functions at evaluation point
+    coeff = [float(coeff_) for coeff_ in _basis_tables(basis[u_t_ind_1]).intvander(t_ref, order[u_t_ind_1])]
 
-    # 1. Create basis vector array...
-    basis_vec_arr = [cheb_plus.basis_vec(i) for i in range(order[u_t_ind_1] + 1)]
-    # 2. ...Calculate integrated vectors...
-    basis_vec_int_arr = [cheb_plus.chebint(basis_vec, lbnd=-1) for basis_vec in basis_vec_arr]
-    # 3. ...Evaluate integrated vectors at evaluation point
-    coeff = [float(cheb_plus.chebval(t_ref, basis_vec_int)) for basis_vec_int in basis_vec_int_arr]
+    # Retrieve coefficients in time of du/dt
+    u_t = _FETcoefficients(u_t_ind_0, u_t_ind_1)
 
     # Evalute output
     if u_ind_1 == None:
         out = u_ind_0 + sum([
-            timestep/2 * coeff_ * u_t_ind_0.sub(sum(order[:u_t_ind_1]) + u_t_ind_1 + i)
-            for (coeff_, i)
-            in zip(coeff, range(order[u_t_ind_1] + 1))
+            timestep/2 * coeff_ * u_t_
+            for (coeff_, u_t_)
+            in zip(coeff, u_t)
         ])
     else:
         out = u_ind_0.sub(u_ind_1) + sum([
-            timestep/2 * coeff_ * u_t_ind_0.sub(sum(order[:u_t_ind_1]) + u_t_ind_1 + i)
-            for (coeff_, i)
-            in zip(coeff, range(order[u_t_ind_1] + 1))
+            timestep/2 * coeff_ * u_t_
+            for (coeff_, u_t_)
+            in zip(coeff, u_t)
         ])
 
     return out
 
+
+
+def FETupdate(u_out, u_ind, u_t_ind, t, timestep):
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: As FETeval, but writes u|t into the Function u_out, as an axpy over the data of u|t=0 and of the components in time of du/dt (With no UFL expression or interpolation kernel), and returns u_out]
+
+    [u_out may be u|t=0 itself]
+    '''
+
+    FETeval_batch([u_out], u_ind, u_t_ind, [t], timestep)
+
+    return u_out
+
+
+
+def FETeval_batch(u_out, u_ind, u_t_ind, t, timestep):
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: As FETupdate, but writes u at each of the times t[k] into the Functions u_out[k] (e.g. for dense output within a timestep), in one pass over the data]
+    '''
+
+    # Normalise inputs
+    timestep = float(timestep)
+
+    # Evaluate reference times on [-1, 1] interval
+    t_ref = [-1 + 2*float(t_)/timestep for t_ in t]
+
+    # Unpackage inputs
+    (u_ind_0,   u_ind_1)   = u_ind
+    (u_t_ind_0, u_t_ind_1) = u_t_ind
+
+    # Retrieve orders and bases in time
+    order = u_t_ind_0.function_space().order
+    basis = u_t_ind_0.function_space().basis
+
+    # Evaluate integrated basis functions at evaluation points
+    coeff = numpy.array([_basis_tables(basis[u_t_ind_1]).intvander(t_ref_, order[u_t_ind_1]) for t_ref_ in t_ref])
+
+    # Retrieve data of u|t=0, and of each component in time of du/dt
+    u_0 = (u_ind_0 if u_ind_1 == None else u_ind_0.subfunctions[u_ind_1]).dat.data_ro
+    u_t = _FETdata(u_t_ind_0, u_t_ind_1)
+
+    # Evaluate outputs (All before writing any, in case an output is also u|t=0)...
+    values = u_0 + timestep/2 * numpy.tensordot(coeff, u_t, axes=(1, 0))
+
+    # ...And write them
+    for (u_out_, value) in zip(u_out, values):
+        u_out_.dat.data[:] = value
+
+    return u_out
+
+
+
+def FETextrapolate(u, u_out=None):
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: Takes a function u in a FET function space (e.g. the solution over the previous timestep), and extrapolates every field to the next timestep (Of the same length), re-expanded in the basis in time there; writes the result into u_out (Default: u itself), and returns u_out]
+
+    [e.g. as a predictor: an initial guess for Newton's method over the next timestep]
+    '''
+
+    u_out = u if u_out is None else u_out
+    space = u.function_space()
+
+    # Extrapolate each field (All before writing any, in case u_out is u)...
+    values = [
+        numpy.tensordot(_basis_tables(basis_).shiftmat(order_), _FETdata(u, k), axes=(1, 0))
+        for (k, (order_, basis_)) in enumerate(zip(space.order, space.basis))
+    ]
+
+    # ...And write them
+    for (k, value) in enumerate(values):
+        _FETwrite(u_out, k, value)
+
+    return u_out
+
+
+
+'''
+[Loosely: Scripts for timestepping]
+'''
+
+
+
+# Predictors of the initial guess for each timestep
+predictors = [None, "extrapolate"]
+
+# Policies for reusing the factorisation of the Jacobian between Newton iterations and timesteps
+reuses = [None, "adaptive"]
+
+
+
+def _FETreuse_parameters(solver_parameters, max_linear_its):
+    # Solver parameters for reuse="adaptive" in FETStepper: GMRES, preconditioned by an LU factorisation that is built once, and then rebuilt only on request
+    # (Capping the linear iterations at a small multiple of max_linear_its, unless given, so a degraded factorisation fails fast into a refactorisation and retry)
+    return {
+        "pc_type": "lu",
+        "pc_factor_mat_solver_type": "mumps",
+        "ksp_max_it": 4*max_linear_its,
+        **(solver_parameters or {}),
+        "ksp_type": "gmres",
+        "snes_lag_preconditioner": -2,
+        "snes_lag_preconditioner_persists": True,
+    }
+
+
+
+class FETStepper:
+    '''
+    [DOCUMENTATION GOES HERE]
+
+    [Loosely: Advances the solution of a space-time residual F == 0 for u one timestep at a time, via step(); owns the solver (Created once, on construction, so each step costs only assembly and linear solves), the diagnostic forms, and the updates of the values at the start of the timestep]
+
+    [updates: A list of (u_out, u_ind, u_t_ind), each updated as by FETupdate(u_out, u_ind, u_t_ind, timestep, timestep) after each solve]
+
+    [diagnostics: A list of terms, as in FETassemble_batch (Combined into a single form on construction), assembled after each solve and before the updates; step() returns their values]
+
+    [predictor: If "extrapolate", the initial guess for each timestep after the first is extrapolated from the solution over the previous one, by FETextrapolate; if None, it is the solution over the previous one]
+
+    [The no. of Newton iterations taken by each step is appended to iterations, and its wall time (Including any compilation, e.g. on the first step) to times]
+
+    [reuse: If "adaptive", the LU factorisation of the Jacobian (Default: with MUMPS) is kept between Newton iterations and timesteps, and used as the preconditioner of GMRES on the current Jacobian; it is refactorised at the next Newton iteration when the last linear solve took more than max_linear_its iterations, or the nonlinear residual contracted by less than max_rate (Unless it is already below the absolute tolerance of the solver, or at roundoff level relative to its initial value), and on a failed solve (Including a linear solve reaching ksp_max_it, default 4*max_linear_its), which is retried (Up to retries times) from the same initial guess; if None, solver_parameters are used as given]
+
+    [For each step, a record of the refactorisations is appended to refactors, with the (Newton iteration, reason) of each requested (events), the no. of factorisations done (count), and, if log, their total time (time; from the PETSc event PCSetUp, for which PETSc logging is begun on construction, at a small cost to every PETSc operation; None otherwise)]
+
+    [The solver, with its matrix, sparsity pattern and symbolic factorisation (e.g. the MUMPS analysis), is kept across steps, so each factorisation after the first is numeric only; reset() starts a new run with the same solver (e.g. after changing the value of a Constant in F), clearing iterations, times and refactors, skipping the predictor on the next step, and (For reuse="adaptive") refactorising on it]
+
+    [kwargs: Passed to solve (solver_parameters, J, partition, parts)]
+    '''
+
+    def __init__(self, F, u, timestep, updates=(), diagnostics=(), predictor=None, reuse=None, max_linear_its=10, max_rate=0.5, retries=2, log=False, **kwargs):
+        if predictor not in predictors:
+            raise ValueError(f"Unknown predictor '{predictor}': must be one of {predictors}")
+        if reuse not in reuses:
+            raise ValueError(f"Unknown reuse '{reuse}': must be one of {reuses}")
+
+        self.F = F
+        self.u = u
+        self.timestep = timestep
+        self.updates = list(updates)
+        self.diagnostics = list(diagnostics)
+        self.predictor = predictor
+        self.reuse = reuse
+        self.max_linear_its = max_linear_its
+        self.max_rate = max_rate
+        self.retries = retries
+        self.log = log
+
+        # No. of Newton iterations, wall time, and record of refactorisations, per step
+        self.iterations = []
+        self.times = []
+        self.refactors = []
+
+        # Solver (Lagging the preconditioner indefinitely, and refactorising on request, for reuse="adaptive")
+        if reuse == "adaptive":
+            kwargs["solver_parameters"] = _FETreuse_parameters(kwargs.get("solver_parameters"), max_linear_its)
+        self.solver = _FETsolver(F, u, **kwargs)
+        if reuse == "adaptive":
+            self.solver.snes.setMonitor(self._monitor)
+            self._guess = u.copy(deepcopy=True)
+            self._fnorm = None
+            self._fnorm0 = None
+            self._pending = True  # Whether a requested refactorisation is yet to be done
+            if log:
+                PETSc.Log.begin()
+
+        # Diagnostic form (And its assembled values, reused between steps)
+        self._diagnostics_form = _FETbatch(self.diagnostics, timestep) if self.diagnostics else None
+        self._diagnostics_vec = None
+
+    def step(self):
+        start = time.perf_counter()
+
+        # 1. Predict the solution over the timestep (If there is a previous one)...
+        if self.predictor == "extrapolate" and self.iterations:
+            FETextrapolate(self.u)
+
+        # 2. ...Solve over it...
+        if self.reuse == "adaptive":
+            self._solve_adaptive()
+        else:
+            self.solver.solve()
+        self.iterations.append(self.solver.snes.getIterationNumber())
+
+        # 3. ...Evaluate the diagnostics over it...
+        if self._diagnostics_form is None:
+            out = [0.0 for _ in self.diagnostics]
+        else:
+            self._diagnostics_vec = assemble(self._diagnostics_form, tensor=self._diagnostics_vec)
+            out = [float(value) for value in self._diagnostics_vec.dat.data_ro.reshape(-1)]
+
+        # 4. ...And update the values at the start of the next
+        for (u_out, u_ind, u_t_ind) in self.updates:
+            FETupdate(u_out, u_ind, u_t_ind, self.timestep, self.timestep)
+
+        self.times.append(time.perf_counter() - start)
+
+        return out
+
+    def reset(self):
+        # Start a new run, keeping the solver (And so its matrix, sparsity pattern and symbolic factorisation)
+        self.iterations = []
+        self.times = []
+        self.refactors = []
+        if self.reuse == "adaptive":
+            self._refactorise(self.solver.snes)
+
+    def _refactorise(self, snes):
+        # Request a refactorisation at the next Newton iteration
+        snes.setLagPreconditioner(-2)
+        self._pending = True
+
+    def _count(self, snes):
+        # Count a requested refactorisation once done (PETSc resetting the lag from -2 to -1 when it rebuilds the preconditioner)
+        if self._pending and snes.getLagPreconditioner() != -2:
+            self.refactors[-1].count += 1
+            self._pending = False
+
+    def _monitor(self, snes, its, fnorm):
+        # Request a refactorisation at the next Newton iteration, if the last linear solve or the contraction of the residual has degraded
+        self._count(snes)
+        (fnorm_, self._fnorm) = (self._fnorm, fnorm)
+        if its == 0:
+            self._fnorm0 = fnorm
+            return
+
+        # (Not testing the contraction of a residual already converged, or at roundoff level, where it is dominated by rounding errors)
+        atol = snes.getTolerances()[1]
+        linear_its = snes.getKSP().getIterationNumber()
+        if linear_its > self.max_linear_its:
+            reason = f"{linear_its} linear iterations"
+        elif fnorm > self.max_rate * fnorm_ and fnorm > max(atol, 100*numpy.finfo(float).eps*self._fnorm0):
+            reason = f"contraction {fnorm/fnorm_:.3g}"
+        else:
+            return
+
+        self._refactorise(snes)
+        self.refactors[-1].events.append((its, reason))
+
+    def _solve_adaptive(self):
+        # Solve, refactorising and retrying from the same initial guess on failure, and record the factorisations done (And their time, from the PCSetUp event, if logged)
+        if self.log:
+            setup = PETSc.Log.Event("PCSetUp")
+            seconds = setup.getPerfInfo()["time"]
+        self.refactors.append(types.SimpleNamespace(events=[], count=0, time=None))
+
+        self._guess.assign(self.u)
+        for attempt in range(self.retries + 1):
+            try:
+                self.solver.solve()
+                break
+            except exceptions.ConvergenceError:
+                if attempt == self.retries:
+                    raise
+                self.u.assign(self._guess)
+                self._count(self.solver.snes)
+                self._refactorise(self.solver.snes)
+                self.refactors[-1].events.append((self.solver.snes.getIterationNumber(), "failed solve"))
+            finally:
+                if self.log:
+                    self.refactors[-1].time = setup.getPerfInfo()["time"] - seconds
@@ -8,11 +8,46 @@ from numpy.polynomial.chebyshev import *
 
 import numpy as np
 import numpy.polynomial.polyutils as pu
+import avfet_modules.table_cache as table_cache
+import itertools
 
 
 
-chebdualmat_dict = {}
-chebprojvec_dict = {}
+# Bounded in-memory caches
+chebdualmat_cache = table_cache.LRUCache(maxsize=64)
+chebprojtable_cache = table_cache.LRUCache(maxsize=64)
+chebmulprojtensor_cache = table_cache.LRUCache(maxsize=256)
+chebleggauss_cache = table_cache.LRUCache(maxsize=64)
+chebdualweights_cache = table_cache.LRUCache(maxsize=64)
+chebintmat_cache = table_cache.LRUCache(maxsize=64)
+chebintvander_cache = table_cache.LRUCache(maxsize=256)
+chebshiftmat_cache = table_cache.LRUCache(maxsize=64)
+
+# Persistent store, shared between processes
+chebtables = table_cache.TableStore("cheb_plus")
+
+
+
+def chebcacheinfo():
+    """
+    Hit and miss counts, and sizes, of the in-memory caches.
+
+    Returns
+    -------
+    out : dict
+        Of dicts with keys "hits", "misses", "size" and "maxsize", for each
+        cache.
+    """
+    return {
+        "chebdualmat": chebdualmat_cache.info(),
+        "chebprojtable": chebprojtable_cache.info(),
+        "chebmulprojtensor": chebmulprojtensor_cache.info(),
+        "chebleggauss": chebleggauss_cache.info(),
+        "chebdualweights": chebdualweights_cache.info(),
+        "chebintmat": chebintmat_cache.info(),
+        "chebintvander": chebintvander_cache.info(),
+        "chebshiftmat": chebshiftmat_cache.info(),
+    }
 
 
 
@@ -76,6 +111,122 @@ def chebmulrec(*c_array):
 
 
 
+def chebmultensor(orders):
+    """
+    Evaluates the Chebyshev series of every product T_{i_1}*...*T_{i_k} of
+    Chebyshev polynomials with 0 <= i_j <= orders[j], in closed form.
+
+    Uses the linearisation T_i*T_j = (T_{i+j} + T_{|i-j|})/2, which
+    extends to
+        T_{i_1}*...*T_{i_k} = 2^(1-k) * sum_{signs} T_{|i_1 +- i_2 ... +- i_k|}.
+
+    Parameters
+    ----------
+    orders : tuple of integers
+        Highest degree of each factor in the product.
+
+    Returns
+    -------
+    out : ndarray
+        Of shape (orders[0]+1, ..., orders[-1]+1, sum(orders)+1), with
+        out[i_1, ..., i_k] the Chebyshev series of T_{i_1}*...*T_{i_k}.
+
+    Examples
+    --------
+    >>> cheb.chebmultensor((1, 1))[1, 1]
+    array([0.5, 0. , 0.5])
+    """
+    # Normalise input
+    orders = tuple(int(order) for order in orders)
+    shape = tuple(order+1 for order in orders)
+
+    # Create output
+    out = np.zeros(shape + (sum(orders)+1,))
+
+    # Trivial case: The empty product is T_0
+    if len(orders) == 0:
+        out[0] = 1.0
+        return out
+
+    # Evaluate the degree of every index combination, for every choice of signs
+    ind = np.indices(shape)
+    weight = 2.0**(1 - len(orders))
+    for signs in itertools.product((1, -1), repeat=len(orders)-1):
+        degree = np.abs(ind[0] + sum(sign*ind_ for (sign, ind_) in zip(signs, ind[1:])))
+        np.add.at(out, tuple(ind) + (degree,), weight)
+
+    return out
+
+
+
+def chebmulprojtensor(orders, p, tol=0.0):
+    """
+    Evaluates the L^2 projections into P^p of every product
+    T_{i_1}*...*T_{i_k} of Chebyshev polynomials with 0 <= i_j <= orders[j].
+
+    The product of Chebyshev polynomials of total degree n contains only
+    polynomials of the same parity as n, and the projection preserves
+    parity; entries of the opposite parity are structurally zero, and are
+    skipped.
+
+    Results are stored in the cache chebmulprojtensor_cache for quicker
+    access once computed, and in the persistent store chebtables.
+
+    Parameters
+    ----------
+    orders : tuple of integers
+        Highest degree of each factor in the product.
+    p : integer
+        Degree of space into which we are projecting.
+    tol : float, optional
+        Entries with magnitude below tol are set to 0.
+
+    Returns
+    -------
+    out : ndarray
+        Of shape (orders[0]+1, ..., orders[-1]+1, p+1), with
+        out[i_1, ..., i_k] the Chebyshev series of the projection of
+        T_{i_1}*...*T_{i_k}.
+
+    Examples
+    --------
+    >>> cheb.chebmulprojtensor((1, 1), 1)[1, 1]
+    array([0.33333333, 0.        ])
+    """
+    # Normalise input
+    orders = tuple(int(order) for order in orders)
+    key = (orders, p, tol)
+
+    # Check if tensor has already been computed, else fetch from persistent store, or evaluate
+    return chebmulprojtensor_cache.fetch(
+        key,
+        lambda : _readonly(chebtables.fetch(
+            ("chebmulprojtensor",) + key,
+            lambda : _chebmulprojtensor(orders, p, tol)
+        ))
+    )
+
+
+
+def _chebmulprojtensor(orders, p, tol):
+    # 1. Evaluate the products...
+    mul = chebmultensor(orders)
+    deg = mul.shape[-1] - 1
+    # 2. ...Retrieve the projection of each Chebyshev polynomial appearing...
+    projmat = chebprojmat(p, deg)
+    # 3. ...Project, separately for each parity
+    out = np.zeros(mul.shape[:-1] + (p+1,))
+    parity = sum(np.indices(mul.shape[:-1])) % 2
+    for r in (0, 1):
+        out[parity == r, r::2] = mul[parity == r, r::2] @ projmat[r::2, r::2]
+
+    # Remove small entries
+    out[abs(out) < tol] = 0.0
+
+    return out
+
+
+
 def chebproj(p, c):
     """
     Project a Chebyshev series into P^p, the space of degree-p polynomials,
@@ -106,11 +257,8 @@ def chebproj(p, c):
         # Make no changes (except removing trailing 0's)
         out = c
     else:
-        # Create vector
-        out = c[:(p+1)]
-        # Project high-order terms
-        for n, coeff in enumerate(c[(p+1):]):
-            out += coeff*chebprojvec(p, n+p+1)
+        # Project
+        out = chebprojbatch(p, c)
 
     # Remove any trailing 0's
     out = pu.trimseq(out)
@@ -119,13 +267,86 @@ def chebproj(p, c):
 
 
 
+def chebprojbatch(p, c):
+    """
+    Project an array of Chebyshev series into P^p, the space of degree-p
+    polynomials, under the L^2 inner product, in a single matrix product.
+
+    Unlike chebproj, the input is never modified, and trailing 0's are kept.
+
+    Parameters
+    ----------
+    p : integer
+        Polynomial degree of target space.
+    c : array_like
+        Array of shape (..., n+1), with c[..., :] Chebyshev series
+        coefficients ordered from low to high.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (..., p+1), representing the Chebyshev series of
+        each projection.
+
+    Examples
+    --------
+    >>> c = [[0,0,1], [0,1,0]]
+    >>> cheb.chebprojbatch(1,c)
+    array([[-0.33333333,  0.        ],
+           [ 0.        ,  1.        ]])
+    """
+    # Normalise input
+    c = np.asarray(c, dtype=float)
+    n = c.shape[-1] - 1
+
+    # Check if the polynomials already lie in P^p...
+    if n <= p:
+        # ...Pad with 0's...
+        out = np.zeros(c.shape[:-1] + (p+1,))
+        out[..., :(n+1)] = c
+    else:
+        # ...Else project
+        out = c @ chebprojmat(p, n)
+
+    return out
+
+
+
+def chebprojmat(p, n):
+    """
+    Evaluates the matrix of the L^2 projection from P^n into P^p, in
+    Chebyshev coefficients.
+
+    Results are stored in the cache chebprojtable_cache for quicker access
+    once computed, and in the persistent store chebtables.
+
+    Parameters
+    ----------
+    p : integer
+        Degree of space into which we are projecting.
+    n : integer
+        Degree of space from which we are projecting.
+
+    Returns
+    -------
+    out : ndarray
+        Read-only array of shape (n+1, p+1), with row m the Chebyshev series
+        of the projection of T_m; a coefficient array c of shape (..., n+1)
+        is projected by c @ out.
+    """
+    return _chebprojtable(p, n)[:(n+1)]
+
+
+
 def chebprojvec(p, n):
     """
     Evaluates a Chebyshev series representing the L^2 projection of T_n, the degree-n
     Chebyshev polynomial, into P^p, the space of degree-p polnoymials.
 
-    Results are stored in the dictionary chebprojvec_dict for quicker access
-    once computed.
+    The projections of every T_n up to (at least) the given n are evaluated
+    together in a single solve against the L^2 mass matrix. Results are stored
+    in the cache chebprojtable_cache for quicker access once computed, and in
+    the persistent store chebtables.
 
     Parameters
     ----------
@@ -136,36 +357,47 @@ def chebprojvec(p, n):
 
     Returns
     -------
-    chebprojvec_dict[p][n] : ndarray
+    out : ndarray
         Array representing the L^2 projection.
     """
-    
-    # Check if any vector at p has already been computed 
-    if p not in chebprojvec_dict:
-        # Create dictionary at p
-        chebprojvec_dict[p] = {}
-
-    # Check if vector at p, n has already been computed
-    if n not in chebprojvec_dict[p]:
-        # Create vector
-        vec = np.zeros(p+1)
-        
-        # Check if projection is trivial
-        if p >= n:
-            vec[n] = 1.0
-        else:
-            # Evaluate
-            chebdualmat_p = chebdualmat(p)
-            for m in range(p+1):
-                if (m + n) % 2 == 0:
-                    inner_prod = 1/(1 - (m+n)**2) + 1/(1 - (m-n)**2)
-                    for l in range(p+1):
-                        vec[l] += inner_prod*chebdualmat_p[l, m]
-        
+    return _chebprojtable(p, n)[n]
+
+
+
+def _chebprojtable(p, n):
+    # Check if projections up to n have already been computed...
+    table = chebprojtable_cache.get(p)
+    if table is None or len(table) <= n:
+        # ...else fetch from persistent store...
+        table = chebtables.get(("chebprojtable", p))
+        if table is None or len(table) <= n:
+            # ...or evaluate (Several degrees ahead, to avoid re-evaluating for every n)
+            table = _chebprojtable_eval(p, max(n, 2*p+1))
+            chebtables.put(("chebprojtable", p), table)
+
         # Store
-        chebprojvec_dict[p][n] = vec
-        
-    return chebprojvec_dict[p][n]
+        table = _readonly(table)
+        chebprojtable_cache.put(p, table)
+
+    return table
+
+
+
+def _chebprojtable_eval(p, n):
+    # Create table, with row m the projection of T_m
+    table = np.zeros([n+1, p+1])
+
+    # Projection of T_m is trivial for m <= p...
+    table[:(p+1)] = np.eye(n+1, p+1)[:(p+1)]
+
+    # ...Else solve M_p x = (<T_l, T_m>)_l, for every m simultaneously
+    if n > p:
+        table[(p+1):] = np.linalg.solve(
+            chebmassmat(p),
+            chebgrammat(np.arange(p+1), np.arange(p+1, n+1))
+        ).T
+
+    return table
 
 
 
@@ -174,8 +406,9 @@ def chebdualmat(p):
     Evaluates the inverse of the L^2 mass matrix of Chebyshev functions,
     up to degree p.
 
-    Results are stored in the dictionary chebdualmat_dict for quicker access
-    once computed.
+    The inverse is evaluated by solving against the (factorised) mass matrix.
+    Results are stored in the cache chebdualmat_cache for quicker access once
+    computed, and in the persistent store chebtables.
 
     Parameters
     ----------
@@ -184,25 +417,246 @@ def chebdualmat(p):
 
     Returns
     -------
-    chebdualmat_dict[p] : ndarray
+    out : ndarray
         Array representing L^2 mass matrix inverse.
     """
 
-    # Check if matrix has already been computed 
-    if p not in chebdualmat_dict:
-        # Create non-inverse matrix
-        mat = np.zeros([p+1, p+1])
-        
-        # Evaluate
-        for m in range(p+1):
-            for n in range(p+1):
-                if (m + n) % 2 == 0:
-                    if m <= n:
-                        mat[m, n] = 1/(1 - (m+n)**2) + 1/(1 - (m-n)**2)
-                    else:
-                        mat[m, n] = mat[n, m]
-        
-        # Invert and store
-        chebdualmat_dict[p] = np.linalg.inv(mat)
-
-    return chebdualmat_dict[p]
+    # Check if matrix has already been computed, else fetch from persistent store, or evaluate
+    return chebdualmat_cache.fetch(
+        p,
+        lambda : _readonly(chebtables.fetch(
+            ("chebdualmat", p),
+            lambda : np.linalg.solve(chebmassmat(p), np.eye(p+1))
+        ))
+    )
+
+
+
+def chebmassmat(p):
+    """
+    Evaluates the L^2 mass matrix of Chebyshev functions, up to degree p.
+
+    Parameters
+    ----------
+    p : integer
+        Highest degree of Chebyshev polnomials.
+
+    Returns
+    -------
+    out : ndarray
+        Array representing L^2 mass matrix.
+    """
+    return chebgrammat(np.arange(p+1), np.arange(p+1))
+
+
+
+def chebgrammat(m, n):
+    """
+    Evaluates the L^2 inner products over [-1, 1] of Chebyshev polynomials,
+    broadcasting over their degrees.
+
+    Parameters
+    ----------
+    m : array_like
+        1-D array of degrees of the first Chebyshev polynomials.
+    n : array_like
+        1-D array of degrees of the second Chebyshev polynomials.
+
+    Returns
+    -------
+    out : ndarray
+        Array with out[i, j] the L^2 inner product of T_m[i] and T_n[j].
+
+    Examples
+    --------
+    >>> cheb.chebgrammat([0, 1], [0, 1, 2])
+    array([[ 2.        ,  0.        , -0.66666667],
+           [ 0.        ,  0.66666667,  0.        ]])
+    """
+    # Broadcast degrees
+    m = np.asarray(m, dtype=float)[:, None]
+    n = np.asarray(n, dtype=float)[None, :]
+
+    # Evaluate (Inner products of polynomials of opposite parity vanish)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = 1/(1 - (m+n)**2) + 1/(1 - (m-n)**2)
+
+    return np.where((m + n) % 2 == 0, out, 0.0)
+
+
+
+def _readonly(arr):
+    # Protect cached tables from modification by callers
+    arr.flags.writeable = False
+
+    return arr
+
+
+
+def chebleggauss(n, leg_pts):
+    """
+    Evaluates the Gauss--Legendre points and weights, and the values of the
+    Chebyshev polynomials up to degree n at those points.
+
+    Results are stored in the cache chebleggauss_cache for quicker access once
+    computed.
+
+    Parameters
+    ----------
+    n : integer
+        Highest degree of Chebyshev polynomials.
+    leg_pts : integer
+        Number of Gauss--Legendre points.
+
+    Returns
+    -------
+    pt : ndarray
+        Gauss--Legendre points.
+    weight : ndarray
+        Gauss--Legendre weights.
+    vander : ndarray
+        Array of shape (leg_pts, n+1), with vander[q, i] the value of T_i at
+        pt[q].
+    """
+    return chebleggauss_cache.fetch((n, leg_pts), lambda : _chebleggauss(n, leg_pts))
+
+
+
+def _chebleggauss(n, leg_pts):
+    (pt, weight) = np.polynomial.legendre.leggauss(leg_pts)
+
+    return (_readonly(pt), _readonly(weight), _readonly(chebvander(pt, n)))
+
+
+
+def chebdualweights(p, leg_pts):
+    """
+    Evaluates the Gauss--Legendre quadrature weights for integrating against
+    the dual basis to the Chebyshev polynomials up to degree p.
+
+    That is, the coefficients of the L^2 projection of f into P^p are
+    approximated by out.T @ f(pt), for pt the Gauss--Legendre points. Results
+    are stored in the cache chebdualweights_cache for quicker access once
+    computed.
+
+    Parameters
+    ----------
+    p : integer
+        Highest degree of Chebyshev polynomials.
+    leg_pts : integer
+        Number of Gauss--Legendre points.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (leg_pts, p+1), with out[q, l] the weight at pt[q]
+        multiplied by the value of the l-th dual basis function at pt[q].
+    """
+    return chebdualweights_cache.fetch((p, leg_pts), lambda : _chebdualweights(p, leg_pts))
+
+
+
+def _chebdualweights(p, leg_pts):
+    (_, weight, vander) = chebleggauss(p, leg_pts)
+
+    return _readonly(np.linalg.solve(chebmassmat(p), (weight[:, None] * vander).T).T)
+
+
+
+def chebintmat(n):
+    """
+    Evaluates the Chebyshev series of the integrals from -1 of the Chebyshev
+    polynomials up to degree n.
+
+    Results are stored in the cache chebintmat_cache for quicker access once
+    computed.
+
+    Parameters
+    ----------
+    n : integer
+        Highest degree of Chebyshev polynomials.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (n+2, n+1), with column i the Chebyshev series of the
+        integral of T_i from -1.
+    """
+    return chebintmat_cache.fetch(n, lambda : _readonly(chebint(np.eye(n+1), lbnd=-1, axis=0)))
+
+
+
+def chebintvander(t, n):
+    """
+    Evaluates the integrals from -1 to t of the Chebyshev polynomials up to
+    degree n.
+
+    Results are stored in the cache chebintvander_cache for quicker access
+    once computed.
+
+    Parameters
+    ----------
+    t : float
+        Upper limit of integration, on the reference interval [-1, 1].
+    n : integer
+        Highest degree of Chebyshev polynomials.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (n+1,), with out[i] the integral of T_i from -1 to t.
+
+    Examples
+    --------
+    >>> cheb.chebintvander(1, 2)
+    array([ 2.        ,  0.        , -0.66666667])
+    """
+    t = float(t)
+
+    return chebintvander_cache.fetch((t, n), lambda : _readonly(chebvander(t, n+1)[0] @ chebintmat(n)))
+
+
+
+def chebshiftmat(n, shift=2.0):
+    """
+    Evaluates the matrix mapping the Chebyshev series of a polynomial p(t) of
+    degree at most n to that of p(t + shift) (e.g. for extrapolation from one
+    interval to the next, of the same length, with shift=2 on the reference
+    interval [-1, 1]).
+
+    Results are stored in the cache chebshiftmat_cache for quicker access once
+    computed.
+
+    Parameters
+    ----------
+    n : integer
+        Highest degree of Chebyshev polynomials.
+    shift : float, optional
+        Shift in t.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (n+1, n+1), with column j the Chebyshev series of
+        T_j(t + shift).
+
+    Examples
+    --------
+    >>> cheb.chebshiftmat(1)
+    array([[1., 2.],
+           [0., 1.]])
+    """
+    shift = float(shift)
+
+    return chebshiftmat_cache.fetch((n, shift), lambda : _readonly(_chebshiftmat(n, shift)))
+
+
+
+def _chebshiftmat(n, shift):
+    # Compose each basis function with t + shift
+    out = np.zeros((n+1, n+1))
+    for j in range(n+1):
+        coef = Chebyshev.basis(j)(Chebyshev([shift, 1])).coef
+        out[:len(coef), j] = coef
+
+    return out
@@ -0,0 +1,495 @@
+'''
+numpy.polynomial.legendre, with the missing ingredients: projection and recursive multiplication
+
+Mirrors cheb_plus, for use as an orthogonal basis in time.
+'''
+
+
+
+from numpy.polynomial.legendre import *
+
+import numpy as np
+import numpy.polynomial.polyutils as pu
+import avfet_modules.table_cache as table_cache
+
+
+
+# Bounded in-memory caches
+legmulprojtensor_cache = table_cache.LRUCache(maxsize=256)
+legleggauss_cache = table_cache.LRUCache(maxsize=64)
+legdualweights_cache = table_cache.LRUCache(maxsize=64)
+legintmat_cache = table_cache.LRUCache(maxsize=64)
+legintvander_cache = table_cache.LRUCache(maxsize=256)
+legshiftmat_cache = table_cache.LRUCache(maxsize=64)
+
+# Persistent store, shared between processes
+legtables = table_cache.TableStore("leg_plus")
+
+
+
+def legcacheinfo():
+    """
+    Hit and miss counts, and sizes, of the in-memory caches.
+
+    Returns
+    -------
+    out : dict
+        Of dicts with keys "hits", "misses", "size" and "maxsize", for each
+        cache.
+    """
+    return {
+        "legmulprojtensor": legmulprojtensor_cache.info(),
+        "legleggauss": legleggauss_cache.info(),
+        "legdualweights": legdualweights_cache.info(),
+        "legintmat": legintmat_cache.info(),
+        "legintvander": legintvander_cache.info(),
+        "legshiftmat": legshiftmat_cache.info(),
+    }
+
+
+
+def basis_vec(order):
+    """
+    Simple basis vector
+
+    Parameters
+    ----------
+    order : int
+        Order of output basis vector
+
+    Returns
+    -------
+    ... : ndarray
+        With "order" 0's, succeeded by a 1
+
+    Examples
+    --------
+    >>> leg.basis_vec(3)
+    array([0., 0., 0., 1.])
+    """
+    return np.append(np.zeros(order), 1)
+
+
+
+def legmulrec(*c_array):
+    """
+    Multiply an array of Legendre series by each other, recursively.
+
+    Returns the product of an array of Legendre series `c_array`.
+
+    Parameters
+    ----------
+    *c_array : tuple of array_likes
+        Arbitrarily long tuple of 1-D arrays of Legendre series
+        coefficients ordered from low to high.
+
+    Returns
+    -------
+    out : ndarray
+        Of Legendre series coefficients representing their product.
+
+    Examples
+    --------
+    >>> leg.legmulrec([0, 1], [0, 1])
+    array([0.33333333, 0.        , 0.66666667])
+    """
+    # Base case: If the array has length, unpack...
+    if len(c_array) == 1:
+        out = c_array[0]
+    # Recursive case: ...otherwise, define product recursively via legmul
+    else:
+        out = legmul(c_array[0], legmulrec(*c_array[1:]))
+
+    # Remove any trailing 0's
+    out = pu.trimseq(out)
+
+    return out
+
+
+
+def legmulprojtensor(orders, p, tol=0.0):
+    """
+    Evaluates the L^2 projections into P^p of every product
+    P_{i_1}*...*P_{i_k} of Legendre polynomials with 0 <= i_j <= orders[j].
+
+    Evaluated exactly, by Gauss--Legendre quadrature. Entries of the wrong
+    parity are structurally zero, and are set to exactly 0.
+
+    Results are stored in the cache legmulprojtensor_cache for quicker access
+    once computed, and in the persistent store legtables.
+
+    Parameters
+    ----------
+    orders : tuple of integers
+        Highest degree of each factor in the product.
+    p : integer
+        Degree of space into which we are projecting.
+    tol : float, optional
+        Entries with magnitude below tol are set to 0.
+
+    Returns
+    -------
+    out : ndarray
+        Of shape (orders[0]+1, ..., orders[-1]+1, p+1), with
+        out[i_1, ..., i_k] the Legendre series of the projection of
+        P_{i_1}*...*P_{i_k}.
+
+    Examples
+    --------
+    >>> leg.legmulprojtensor((1, 1), 1)[1, 1]
+    array([0.33333333, 0.        ])
+    """
+    # Normalise input
+    orders = tuple(int(order) for order in orders)
+    key = (orders, p, tol)
+
+    # Check if tensor has already been computed, else fetch from persistent store, or evaluate
+    return legmulprojtensor_cache.fetch(
+        key,
+        lambda : _readonly(legtables.fetch(
+            ("legmulprojtensor",) + key,
+            lambda : _legmulprojtensor(orders, p, tol)
+        ))
+    )
+
+
+
+def _legmulprojtensor(orders, p, tol):
+    # Get Gauss--Legendre points, exact for the product with a degree-p test function
+    leg_pts = (sum(orders) + p) // 2 + 1
+    (pt, weight) = leggauss(leg_pts)
+
+    # 1. Multiply the weights by each factor in turn...
+    mul = weight
+    for order in orders:
+        mul = mul[..., None] * legvander(pt, order).reshape((leg_pts,) + (1,)*(mul.ndim-1) + (order+1,))
+    # 2. ...And integrate against the dual basis
+    out = np.tensordot(mul, legvander(pt, p) / legmassmat(p).diagonal(), axes=(0, 0))
+
+    # Remove structurally zero and small entries
+    ind = np.indices(out.shape)
+    out[sum(ind) % 2 != 0] = 0.0
+    out[abs(out) < tol] = 0.0
+
+    return out
+
+
+
+def legproj(p, c):
+    """
+    Project a Legendre series into P^p, the space of degree-p polynomials,
+    under the L^2 inner product. (By orthogonality, this is a truncation.)
+
+    Parameters
+    ----------
+    p : integer
+        Polynomial degree of target space.
+    c : array_like
+        1-D arrays of Legendre series coefficients ordered from low to
+        high.
+
+    Returns
+    -------
+    out : ndarray
+        Array representing the Legendre series of the projection.
+
+    Examples
+    --------
+    >>> c = (1,2,3)
+    >>> leg.legproj(1,c)
+    array([1., 2.])
+    """
+    return pu.trimseq(np.array(c[:(p+1)], dtype=float))
+
+
+
+def legprojbatch(p, c):
+    """
+    Project an array of Legendre series into P^p, the space of degree-p
+    polynomials, under the L^2 inner product.
+
+    The input is never modified, and trailing 0's are kept.
+
+    Parameters
+    ----------
+    p : integer
+        Polynomial degree of target space.
+    c : array_like
+        Array of shape (..., n+1), with c[..., :] Legendre series
+        coefficients ordered from low to high.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (..., p+1), representing the Legendre series of each
+        projection.
+    """
+    # Normalise input
+    c = np.asarray(c, dtype=float)
+    n = c.shape[-1] - 1
+
+    # Truncate, or pad with 0's
+    out = np.zeros(c.shape[:-1] + (p+1,))
+    out[..., :(min(n, p)+1)] = c[..., :(min(n, p)+1)]
+
+    return out
+
+
+
+def legprojmat(p, n):
+    """
+    Evaluates the matrix of the L^2 projection from P^n into P^p, in
+    Legendre coefficients.
+
+    Parameters
+    ----------
+    p : integer
+        Degree of space into which we are projecting.
+    n : integer
+        Degree of space from which we are projecting.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (n+1, p+1), with row m the Legendre series of the
+        projection of P_m; a coefficient array c of shape (..., n+1) is
+        projected by c @ out.
+    """
+    return np.eye(n+1, p+1)
+
+
+
+def legprojvec(p, n):
+    """
+    Evaluates a Legendre series representing the L^2 projection of P_n, the
+    degree-n Legendre polynomial, into P^p, the space of degree-p polnoymials.
+
+    Parameters
+    ----------
+    p : integer
+        Degree of space into which we are projecting.
+    n : integer
+        Degree of Legendre polnomial to be projected.
+
+    Returns
+    -------
+    out : ndarray
+        Array representing the L^2 projection.
+    """
+    return np.eye(n+1, p+1)[n]
+
+
+
+def legdualmat(p):
+    """
+    Evaluates the inverse of the L^2 mass matrix of Legendre functions,
+    up to degree p. (By orthogonality, this is diagonal.)
+
+    Parameters
+    ----------
+    p : integer
+        Highest degree of Legendre polnomials.
+
+    Returns
+    -------
+    out : ndarray
+        Array representing L^2 mass matrix inverse.
+    """
+    return np.diag((2*np.arange(p+1) + 1) / 2)
+
+
+
+def legmassmat(p):
+    """
+    Evaluates the L^2 mass matrix of Legendre functions, up to degree p.
+    (By orthogonality, this is diagonal.)
+
+    Parameters
+    ----------
+    p : integer
+        Highest degree of Legendre polnomials.
+
+    Returns
+    -------
+    out : ndarray
+        Array representing L^2 mass matrix.
+    """
+    return np.diag(2 / (2*np.arange(p+1) + 1))
+
+
+
+def _readonly(arr):
+    # Protect cached tables from modification by callers
+    arr.flags.writeable = False
+
+    return arr
+
+
+
+def legleggauss(n, leg_pts):
+    """
+    Evaluates the Gauss--Legendre points and weights, and the values of the
+    Legendre polynomials up to degree n at those points.
+
+    Results are stored in the cache legleggauss_cache for quicker access once
+    computed.
+
+    Parameters
+    ----------
+    n : integer
+        Highest degree of Legendre polynomials.
+    leg_pts : integer
+        Number of Gauss--Legendre points.
+
+    Returns
+    -------
+    pt : ndarray
+        Gauss--Legendre points.
+    weight : ndarray
+        Gauss--Legendre weights.
+    vander : ndarray
+        Array of shape (leg_pts, n+1), with vander[q, i] the value of P_i at
+        pt[q].
+    """
+    return legleggauss_cache.fetch((n, leg_pts), lambda : _legleggauss(n, leg_pts))
+
+
+
+def _legleggauss(n, leg_pts):
+    (pt, weight) = leggauss(leg_pts)
+
+    return (_readonly(pt), _readonly(weight), _readonly(legvander(pt, n)))
+
+
+
+def legdualweights(p, leg_pts):
+    """
+    Evaluates the Gauss--Legendre quadrature weights for integrating against
+    the dual basis to the Legendre polynomials up to degree p.
+
+    That is, the coefficients of the L^2 projection of f into P^p are
+    approximated by out.T @ f(pt), for pt the Gauss--Legendre points. Results
+    are stored in the cache legdualweights_cache for quicker access once
+    computed.
+
+    Parameters
+    ----------
+    p : integer
+        Highest degree of Legendre polynomials.
+    leg_pts : integer
+        Number of Gauss--Legendre points.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (leg_pts, p+1), with out[q, l] the weight at pt[q]
+        multiplied by the value of the l-th dual basis function at pt[q].
+    """
+    return legdualweights_cache.fetch((p, leg_pts), lambda : _legdualweights(p, leg_pts))
+
+
+
+def _legdualweights(p, leg_pts):
+    (_, weight, vander) = legleggauss(p, leg_pts)
+
+    return _readonly(weight[:, None] * vander / legmassmat(p).diagonal())
+
+
+
+def legintmat(n):
+    """
+    Evaluates the Legendre series of the integrals from -1 of the Legendre
+    polynomials up to degree n.
+
+    Results are stored in the cache legintmat_cache for quicker access once
+    computed.
+
+    Parameters
+    ----------
+    n : integer
+        Highest degree of Legendre polynomials.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (n+2, n+1), with column i the Legendre series of the
+        integral of P_i from -1.
+    """
+    return legintmat_cache.fetch(n, lambda : _readonly(legint(np.eye(n+1), lbnd=-1, axis=0)))
+
+
+
+def legintvander(t, n):
+    """
+    Evaluates the integrals from -1 to t of the Legendre polynomials up to
+    degree n.
+
+    Results are stored in the cache legintvander_cache for quicker access
+    once computed.
+
+    Parameters
+    ----------
+    t : float
+        Upper limit of integration, on the reference interval [-1, 1].
+    n : integer
+        Highest degree of Legendre polynomials.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (n+1,), with out[i] the integral of P_i from -1 to t.
+
+    Examples
+    --------
+    >>> leg.legintvander(0, 1)
+    array([ 1. , -0.5])
+    """
+    t = float(t)
+
+    return legintvander_cache.fetch((t, n), lambda : _readonly(legvander(t, n+1)[0] @ legintmat(n)))
+
+
+
+def legshiftmat(n, shift=2.0):
+    """
+    Evaluates the matrix mapping the Legendre series of a polynomial p(t) of
+    degree at most n to that of p(t + shift) (e.g. for extrapolation from one
+    interval to the next, of the same length, with shift=2 on the reference
+    interval [-1, 1]).
+
+    Results are stored in the cache legshiftmat_cache for quicker access once
+    computed.
+
+    Parameters
+    ----------
+    n : integer
+        Highest degree of Legendre polynomials.
+    shift : float, optional
+        Shift in t.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (n+1, n+1), with column j the Legendre series of
+        P_j(t + shift).
+
+    Examples
+    --------
+    >>> leg.legshiftmat(1)
+    array([[1., 2.],
+           [0., 1.]])
+    """
+    shift = float(shift)
+
+    return legshiftmat_cache.fetch((n, shift), lambda : _readonly(_legshiftmat(n, shift)))
+
+
+
+def _legshiftmat(n, shift):
+    # Compose each basis function with t + shift
+    out = np.zeros((n+1, n+1))
+    for j in range(n+1):
+        coef = Legendre.basis(j)(Legendre([shift, 1])).coef
+        out[:len(coef), j] = coef
+
+    return out
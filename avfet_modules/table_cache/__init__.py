@@ -0,0 +1,212 @@
+'''
+In-memory and persistent on-disk stores for precomputed coefficient tables
+
+LRUCache is a bounded, thread-safe, in-memory cache that counts its hits and
+misses.
+
+TableStore keeps tables in one versioned .npz file per store, in the directory
+given by the environment variable AVFET_CACHE_DIR (default: "avfet_modules/"
+in the user cache directory). Setting AVFET_CACHE_DIR to an empty string
+disables the store. The file is opened on first lookup, and each table is read
+from it only when first looked up; new tables are written back atomically at
+exit, by the first MPI rank only, so that every process (and every MPI rank)
+starts warm.
+'''
+import atexit
+import collections
+import os
+import sys
+import tempfile
+import threading
+import zipfile
+import numpy as np
+
+
+
+# Increment whenever the definition of a stored table changes
+version = 1
+
+# Location of stores
+cache_dir = os.environ.get(
+    "AVFET_CACHE_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "avfet_modules")
+)
+
+
+
+def _rank():
+    # Rank of this process in MPI_COMM_WORLD (From mpi4py, if in use, or else from the environment set by mpiexec; 0 in serial)
+    MPI = sys.modules.get("mpi4py.MPI")
+    if MPI is not None and MPI.Is_initialized() and not MPI.Is_finalized():
+        return MPI.COMM_WORLD.rank
+
+    return int(os.environ.get("OMPI_COMM_WORLD_RANK", os.environ.get("PMI_RANK", 0)))
+
+
+
+class LRUCache:
+    '''
+    Dictionary-like cache holding at most maxsize entries, discarding the
+    least recently used entry first.
+    '''
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            else:
+                self.misses += 1
+                return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def fetch(self, key, compute):
+        '''
+        Return the entry at key, evaluating and storing compute() if there is
+        none. (compute() is evaluated outside the lock, so may occasionally be
+        evaluated twice by concurrent threads.)
+        '''
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+
+class TableStore:
+    '''
+    Dictionary-like store of ndarrays, keyed by tuples, backed by the file
+    "<name>_v<version>.npz" in cache_dir.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self._file = None  # Opened lazily
+        self._tables = {}  # Tables read from the file, or put
+        self._new = {}  # Tables not yet written to disk
+
+        # Write new tables at exit
+        atexit.register(self.save)
+
+    def path(self):
+        return os.path.join(cache_dir, f"{self.name}_v{version}.npz")
+
+    def _open(self):
+        # Open the file on disk without reading any table (Treating a missing or corrupt file as empty)
+        try:
+            return np.load(self.path())
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            return {}
+
+    def _read(self):
+        # Read every table currently on disk
+        data = self._open()
+        try:
+            return {key: data[key] for key in data}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            return {}
+        finally:
+            if hasattr(data, "close"):
+                data.close()
+
+    def get(self, key):
+        # Check if store is disabled
+        if not cache_dir:
+            return None
+
+        # Open on first lookup
+        if self._file is None:
+            self._file = self._open()
+
+        # Read table on first lookup
+        key = repr(key)
+        if key not in self._tables and key in self._file:
+            try:
+                self._tables[key] = self._file[key]
+            except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+                return None
+
+        return self._tables.get(key)
+
+    def put(self, key, value):
+        # Check if store is disabled
+        if not cache_dir:
+            return
+
+        self._tables[repr(key)] = value
+        self._new[repr(key)] = value
+
+    def fetch(self, key, compute):
+        '''
+        Return the table stored at key, evaluating and storing compute() if
+        there is none.
+        '''
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+
+        return value
+
+    def save(self):
+        # Check if there is anything to write (On the first MPI rank only, as every rank computes the same tables)
+        if not cache_dir or not self._new or _rank() != 0:
+            return
+
+        # Merge with tables written by other processes in the meantime...
+        tables = self._read()
+        tables.update(self._new)
+
+        # ...And replace the file atomically
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=self.name, suffix=".npz", delete=False) as file:
+                try:
+                    np.savez(file, **tables)
+                except BaseException:
+                    os.remove(file.name)
+                    raise
+            try:
+                os.replace(file.name, self.path())
+            except OSError:
+                os.remove(file.name)
+                raise
+        except OSError:
+            # (A read-only cache directory is not an error)
+            return
+
+        self._new = {}
@@ -15,4 +15,7 @@ def get(option, type=None, default=None):
     elif default == None:
         raise ValueError(option_string, "must be specified")
     else:
-        return default
\ No newline at end of file
+        return default
+
+def flag(option):
+    return "--" + option in sys.argv
@@ -0,0 +1,41 @@
+'''
+Ahead-of-time compilation of the kernels of the drivers
+
+Each driver is run with the option --warmup, under which it builds its
+residual, Jacobian and diagnostics, assembles each once (So that their kernels
+are compiled, and stored in the on-disk caches of the form compiler and
+PyOP2), and exits without solving. Drivers are run concurrently, each in its
+own process, from the root directory.
+'''
+import concurrent.futures
+import subprocess
+import sys
+
+
+
+# Drivers with a warm-up (Relative to the root directory)
+drivers = [
+    "incompressible_ns/avfet.py",
+    "incompressible_ns/avfet_nohelicity.py",
+    "benjamin_bona_mahony/avfet.py",
+    "compressible_ns/supersonic/avfet.py",
+    "compressible_ns/euler/avfet.py",
+    "benjamin_bona_mahony/gauss.py",
+    "compressible_ns/supersonic/im.py",
+    "compressible_ns/euler/im.py",
+]
+
+
+
+def run(drivers=drivers, processes=None):
+    '''
+    Run each of drivers with --warmup, at most processes at a time (Default:
+    all at once), returning the completed processes (With their output).
+    '''
+    processes = len(drivers) if processes is None else processes
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(processes, 1)) as pool:
+        return list(pool.map(
+            lambda driver : subprocess.run([sys.executable, driver, "--warmup"], capture_output=True, text=True),
+            drivers
+        ))
@@ -0,0 +1,27 @@
+'''
+Warm up the kernels of the drivers, by running
+    >> python -m avfet_modules.warmup
+in the root directory (Optionally with --drivers, a comma-separated list of
+drivers, and --processes, the no. of drivers to run at a time)
+'''
+import sys
+import avfet_modules.terminal_options as terminal_options
+import avfet_modules.warmup as warmup
+
+
+
+drivers = terminal_options.get("drivers", default=",".join(warmup.drivers)).split(",")
+processes = terminal_options.get("processes", type=int, default=len(drivers))
+
+# Run drivers...
+results = warmup.run(drivers, processes)
+
+# ...And report
+for (driver, result) in zip(drivers, results):
+    if result.returncode == 0:
+        print(f"{driver}: Done")
+    else:
+        print(f"{driver}: Failed (Exit code {result.returncode})")
+        print(result.stderr)
+
+sys.exit(0 if all(result.returncode == 0 for result in results) else 1)
@@ -5,6 +5,7 @@ from firedrake import *
 import avfet_modules.cheb_fet as cheb_fet
 import numpy as np
 import avfet_modules.terminal_options as terminal_options
+import sys
 
 
 
@@ -38,6 +39,7 @@ nx = terminal_options.get("L", type=int, default=L/2)  # Mesh number (Per unit l
 stages = terminal_options.get("stages", type=int, default=2)  # (Max.) temporal degree (Must be >=1 | Equiv. to no. of steps in timestepping scheme)
 dur = Constant(terminal_options.get("dur", type=float, default=20000))  # Duration
 dt = Constant(terminal_options.get("dt", type=float, default=1))  # Timestep
+layout = terminal_options.get("layout", type=str, default="block")  # Layout of coefficients in time ("block" or "interleaved")
 
 # Initial conditions
 c_max = Constant(terminal_options.get("c_max", type=float, default=float(1+sqrt(5))/2))  # Max soliton speed (Must be >=1)
@@ -62,7 +64,7 @@ Function spaces
 U_ = FunctionSpace(mesh, "HER", 3)  # Persistent/intermediate value space (For e.g. u|_t^n)
 
 # Individual (space-time) spaces (For composition...)
-U = cheb_fet.FETFunctionSpace(mesh, "HER", 3, stages-1)  # u_t
+U = cheb_fet.FETFunctionSpace(mesh, "HER", 3, stages-1, layout=layout)  # u_t
 
 # Mixed (space-time) spaces (...as required)
 UR  = cheb_fet.FETMixedFunctionSpace([U, U])  # (u_t, r)
@@ -101,7 +103,7 @@ u = cheb_fet.integrate(u_t, u_, dt)
 Residual definition
 '''
 # Initialise residual
-F = 0
+F = cheb_fet.ResidualBuilder()
 
 # LHS
 F = cheb_fet.residual(
@@ -110,13 +112,15 @@ F = cheb_fet.residual(
         inner(a, b)
       + inner(a.dx(0), b.dx(0))
     )*dx,
-    (u_t, v)
+    (u_t, v),
+    kron=True
 )
 # RHS
 F = cheb_fet.residual(
     F,
     lambda a, b: inner(a - a.dx(0).dx(0), b.dx(0))*dx,
-    (r, v)
+    (r, v),
+    kron=True
 )
 
 # AV LHS
@@ -126,18 +130,23 @@ F = cheb_fet.residual(
         inner(a, b)
       + inner(a.dx(0), b.dx(0))
     )*dx,
-    (r, s)
+    (r, s),
+    kron=True
 )
 # AV RHS
 F = cheb_fet.residual(
     F,
     lambda a, b : inner(a, b)*dx,
-    (u, s)
+    (u, s),
+    kron=True
 )
 F = cheb_fet.residual(
     F,
     lambda a, b, c : 0.5 * inner(a * b, c)*dx,
-    (u, u, s)
+    (u, u, s),
+    poly=False,
+    literal=True,
+    leg_pts="exact"
 )
 
 
@@ -180,22 +189,32 @@ h1_norm = assemble((u_**2 + u_.dx(0)**2) * dx)  # H1 norm
 print(GREEN % f"H1 norm: {h1_norm}")
 h1_norm_data = h1_norm
 
+# Compile kernels without solving, then exit (If run with --warmup)
+if terminal_options.flag("warmup"):
+    cheb_fet.warmup(F, ur)
+    sys.exit()
+
+# Create stepper (Solving for ur, and updating u)
+# (Extrapolating the initial guess for each timestep from the previous one if run with --extrapolate)
+stepper = cheb_fet.FETStepper(
+    F,
+    ur,
+    dt,
+    updates = [(u_, (u_, None), (ur, 0))],
+    predictor = "extrapolate" if terminal_options.flag("extrapolate") else None,
+    solver_parameters = sp
+)
+
 # Solve
 time = Constant(0.0)
 while (float(time) < float(dur) - float(dt)/2):
     # Print timestep
     print(BLUE % f"Solving for t = {float(time) + float(dt)}:")
 
-    # Solve
-    solve(F == 0, ur, solver_parameters = sp)
-
-    # Update u
-    u_.assign(cheb_fet.FETeval(
-        (u_, None),
-        (ur, 0),
-        dt,
-        dt
-    ))
+    # Solve, and update u
+    stepper.step()
+    print(BLUE % f"Newton iterations: {stepper.iterations[-1]}")
+    print(BLUE % f"Step time: {stepper.times[-1]:.2f}s")
 
     # Record data
     u_data = np.vstack((u_data, u_.dat.data))  # u
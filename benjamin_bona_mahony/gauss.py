@@ -5,6 +5,7 @@ from firedrake import *
 from irksome import *
 import numpy as np
 import avfet_modules.terminal_options as terminal_options
+import sys
 
 
 
@@ -136,7 +137,15 @@ h1_norm_data = h1_norm
 
 # Set up timestepper
 time = Constant(0.0)
-stepper = TimeStepper(F, GaussLegendre(stages), time, dt, u, solver_parameters=sp)
+butcher_tableau = GaussLegendre(stages)
+stepper = TimeStepper(F, butcher_tableau, time, dt, u, solver_parameters=sp)
+
+# Compile kernels of the stage residual and Jacobian without solving, then exit (If run with --warmup; the stage residual is built by getForm, as in the timestepper, for the stages k)
+if terminal_options.flag("warmup"):
+    (F_stages, k) = getForm(F, butcher_tableau, time, dt, u)[:2]
+    assemble(F_stages)
+    assemble(derivative(F_stages, k), mat_type="aij")
+    sys.exit()
 
 # Solve
 while (float(time) < float(dur) - float(dt)/2):
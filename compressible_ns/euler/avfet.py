@@ -3,8 +3,9 @@ Imports
 '''
 from firedrake import *
 import avfet_modules.cheb_fet as cheb_fet
-import gc
+import avfet_modules.terminal_options as terminal_options
 import numpy as np
+import sys
 
 
 
@@ -139,7 +140,7 @@ tau = lambda u : sym(grad(u)) - 1/3 * div(u) * Identity(2)
 
 
 # Initialise
-F = 0
+F = cheb_fet.ResidualBuilder()
 
 
 
@@ -154,7 +155,8 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c, d : - inner(rho_tilde(a, b) * c, grad(d)) * dx,
     (g_tilde, beta_tilde, u_tilde, v_rho),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
@@ -173,7 +175,8 @@ F = cheb_fet.residual(
       - inner(rho_tilde(a, b) * dot(grad(c), c), d)
     ) * dx,
     (g_tilde, beta_tilde, u_tilde, v_m),
-    poly=False
+    poly=False,
+    literal=True
 )
 # F = cheb_fet.residual(
 #     F,
@@ -185,7 +188,8 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c : inner(grad(p_tilde_fast(a, b)), c) * dx,
     (g_tilde, beta_tilde, v_m),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
@@ -195,14 +199,16 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c : inner(exp(a) * b, c) * dx,
     (ln_eps, ln_eps_t, v_eps),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 F = cheb_fet.residual(
     F,
     lambda a, b, c, d : - inner(eps_tilde(a, b) * c, grad(d)) * dx,
     (g_tilde, beta_tilde, u_tilde, v_eps),
-    poly=False
+    poly=False,
+    literal=True
 )
 # F = cheb_fet.residual(
 #     F,
@@ -220,7 +226,8 @@ F = cheb_fet.residual(
       + inner(p_tilde_fast(a, b) * c, grad(d))
     ) * dx,
     (g_tilde, beta_tilde, u_tilde, v_eps),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
@@ -242,7 +249,8 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c : - 2 * inner(a * g_fast(a, b), c) * dx,
     (sigma, ln_eps, v_g),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
@@ -257,7 +265,8 @@ F = cheb_fet.residual(
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(a, b) * dx,
-    (mu, v_u)
+    (mu, v_u),
+    kron=True
 )
 
 
@@ -267,18 +276,25 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c : inner(exp(a) * b, c) * dx,
     (ln_eps, beta_tilde, v_beta),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 F = cheb_fet.residual(
     F,
     lambda a, b, c : - inner(exp(a) / theta(b**2, exp(a)), c) * dx,
     (ln_eps, sigma, v_beta),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
 
+# Jacobian (Built term-wise)
+(_, J) = cheb_fet.FETjacobian(F, smegub)
+
+
+
 '''
 Solver parameters
 '''
@@ -304,6 +320,16 @@ sp = {
 
 
 
+'''
+Warm-up
+'''
+# Compile kernels without solving, then exit (If run with --warmup)
+if terminal_options.flag("warmup"):
+    cheb_fet.warmup(F, smegub, J = J)
+    sys.exit()
+
+
+
 '''
 Solve setup
 '''
@@ -361,21 +387,36 @@ if mesh.comm.rank == 0:
 '''
 Solve
 '''
+# Create stepper (Solving for smegub, and updating variables)
+# (Extrapolating the initial guess for each timestep from the previous one if run with --extrapolate, reusing the LU factorisation as a preconditioner across Newton iterations and timesteps if run with --reuse, and timing factorisations if run with --log)
+stepper = cheb_fet.FETStepper(
+    F,
+    smegub,
+    timestep,
+    updates = [
+        (sigma_sub, (sme_, 0), (smegub, 0)),
+        (mu_sub, (sme_, 1), (smegub, 1)),
+        (ln_eps_sub, (sme_, 2), (smegub, 2)),
+    ],
+    predictor = "extrapolate" if terminal_options.flag("extrapolate") else None,
+    reuse = "adaptive" if terminal_options.flag("reuse") else None,
+    log = terminal_options.flag("log"),
+    solver_parameters = sp,
+    J = J
+)
+
 time = Constant(0.0)
 while (float(time) < float(duration) - float(timestep)/2):
     # Print timestep
     print(RED % f"Solving for t = {float(time) + float(timestep)}:")
 
-    # Solve
-    solve(F == 0, smegub, solver_parameters = sp)
-
-    # Collect garbage
-    gc.collect()
-
-    # Update variables
-    sigma_sub.assign(cheb_fet.FETeval((sme_, 0), (smegub, 0), timestep, timestep))
-    mu_sub.assign(cheb_fet.FETeval((sme_, 1), (smegub, 1), timestep, timestep))
-    ln_eps_sub.assign(cheb_fet.FETeval((sme_, 2), (smegub, 2), timestep, timestep))
+    # Solve, and update variables
+    stepper.step()
+    print(BLUE % f"Newton iterations: {stepper.iterations[-1]}")
+    print(BLUE % f"Step time: {stepper.times[-1]:.2f}s")
+    if stepper.reuse == "adaptive":
+        refactors = stepper.refactors[-1]
+        print(BLUE % f"Factorisations: {refactors.count}{'' if refactors.time is None else f' ({refactors.time:.2f}s)'}, requested: {refactors.events}")
 
     # Write to Paraview
     pvd.write(sigma_sub, mu_sub, ln_eps_sub)
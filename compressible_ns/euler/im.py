@@ -1,7 +1,9 @@
 # Imports
 from firedrake import *
+import avfet_modules.terminal_options as terminal_options
 import numpy as np
 import gc
+import sys
 
 
 
@@ -168,6 +170,18 @@ sp = {
 
 
 
+# Compile kernels without solving, then exit (If run with --warmup)
+if terminal_options.flag("warmup"):
+    assemble(F)
+    assemble(derivative(F, sme), mat_type = "aij")
+    sys.exit()
+
+
+
+#####
+
+
+
 # Record IC values
 #   Create ParaView file
 pvd = File("output/compressible_ns/euler/im/solution.pvd")
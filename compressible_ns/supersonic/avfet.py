@@ -3,8 +3,9 @@ Imports
 '''
 from firedrake import *
 import avfet_modules.cheb_fet as cheb_fet
+import avfet_modules.terminal_options as terminal_options
 import numpy as np
-import gc
+import sys
 
 
 
@@ -142,7 +143,7 @@ tau = lambda u : sym(grad(u)) - 1/3 * div(u) * Identity(2)
 
 
 # Initialise
-F = 0
+F = cheb_fet.ResidualBuilder()
 
 
 
@@ -157,7 +158,8 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c, d : - inner(rho_tilde(a, b) * c, grad(d)) * dx,
     (g_tilde, beta_tilde, u_tilde, v_rho),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
@@ -176,7 +178,8 @@ F = cheb_fet.residual(
       - inner(rho_tilde(a, b) * dot(grad(c), c), d)
     ) * dx,
     (g_tilde, beta_tilde, u_tilde, v_m),
-    poly=False
+    poly=False,
+    literal=True
 )
 # F = cheb_fet.residual(
 #     F,
@@ -188,7 +191,8 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c : inner(grad(p_tilde_fast(a, b)), c) * dx,
     (g_tilde, beta_tilde, v_m),
-    poly=False
+    poly=False,
+    literal=True
 )
 # F = cheb_fet.residual(
 #     F,
@@ -198,12 +202,14 @@ F = cheb_fet.residual(
 F = cheb_fet.residual(
     F,
     lambda a, b, c, d : 2/Re * a * b * inner(sym(grad(c)), sym(grad(d))) * dx,
-    (sigma, sigma, u_tilde, v_m)
+    (sigma, sigma, u_tilde, v_m),
+    symmetric=True
 )
 F = cheb_fet.residual(
     F,
     lambda a, b, c, d : - 2/Re * 1/3 * a * b * inner(div(c), div(d)) * dx,
-    (sigma, sigma, u_tilde, v_m)
+    (sigma, sigma, u_tilde, v_m),
+    symmetric=True
 )
 
 
@@ -213,14 +219,16 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c : inner(exp(a) * b, c) * dx,
     (ln_eps, ln_eps_t, v_eps),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 F = cheb_fet.residual(
     F,
     lambda a, b, c, d : - inner(eps_tilde(a, b) * c, grad(d)) * dx,
     (g_tilde, beta_tilde, u_tilde, v_eps),
-    poly=False
+    poly=False,
+    literal=True
 )
 # F = cheb_fet.residual(
 #     F,
@@ -238,7 +246,8 @@ F = cheb_fet.residual(
       + inner(p_tilde_fast(a, b) * c, grad(d))
     ) * dx,
     (g_tilde, beta_tilde, u_tilde, v_eps),
-    poly=False
+    poly=False,
+    literal=True
 )
 # F = cheb_fet.residual(
 #     F,
@@ -248,18 +257,21 @@ F = cheb_fet.residual(
 F = cheb_fet.residual(
     F,
     lambda a, b, c, d, e : - 2/Re * a * b * inner(inner(sym(grad(c)), sym(grad(d))), e) * dx,
-    (sigma, sigma, u_tilde, u_tilde, v_eps)
+    (sigma, sigma, u_tilde, u_tilde, v_eps),
+    symmetric=True
 )
 F = cheb_fet.residual(
     F,
     lambda a, b, c, d, e : 2/Re * 1/3 * a * b * inner(inner(div(c), div(d)), e) * dx,
-    (sigma, sigma, u_tilde, u_tilde, v_eps)
+    (sigma, sigma, u_tilde, u_tilde, v_eps),
+    symmetric=True
 )
 F = cheb_fet.residual(
     F,
     lambda a, b, c, d : - 1/Re/Pr * a**2 * theta(a**2, exp(b))**2 * inner(grad(c), grad(d)) * dx,
     (sigma, ln_eps, beta_tilde, v_eps),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
@@ -281,7 +293,8 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c : - 2 * inner(a * g_fast(a, b), c) * dx,
     (sigma, ln_eps, v_g),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
@@ -296,7 +309,8 @@ F = cheb_fet.residual(
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(a, b) * dx,
-    (mu, v_u)
+    (mu, v_u),
+    kron=True
 )
 
 
@@ -306,18 +320,25 @@ F = cheb_fet.residual(
     F,
     lambda a, b, c : inner(exp(a) * b, c) * dx,
     (ln_eps, beta_tilde, v_beta),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 F = cheb_fet.residual(
     F,
     lambda a, b, c : - inner(exp(a) / theta(b**2, exp(a)), c) * dx,
     (ln_eps, sigma, v_beta),
-    poly=False
+    poly=False,
+    literal=True
 )
 
 
 
+# Jacobian (Built term-wise)
+(_, J) = cheb_fet.FETjacobian(F, smegub)
+
+
+
 '''
 Solver parameters
 '''
@@ -341,6 +362,43 @@ sp = {
     "ksp_monitor_true_residual" : None,
 }
 
+# Partition of the residual into parts assembled separately, each with its own Jacobian (e.g. --partition block; not partitioned by default)
+partition = terminal_options.get("partition") if terminal_options.flag("partition") else None
+
+
+
+'''
+Diagnostics
+'''
+# Viscous (Symmetric and divergence parts) and thermal dissipation
+dissipation = [
+    (
+        lambda a, b, c, d, e : 2/Re * a*b * c * inner(sym(grad(d)), sym(grad(e))) * dx,
+        (sigma, sigma, beta_tilde, u_tilde, u_tilde),
+        {"symmetric": True}
+    ),
+    (
+        lambda a, b, c, d, e : - 2/Re * 1/3 * a*b * c * inner(div(d), div(e)) * dx,
+        (sigma, sigma, beta_tilde, u_tilde, u_tilde),
+        {"symmetric": True}
+    ),
+    (
+        lambda a, b, c : 1/Re/Pr * a**2 * theta(a**2, exp(b))**2 * inner(grad(c), grad(c)) * dx,
+        (sigma, ln_eps, beta_tilde),
+        {"poly": False}
+    ),
+]
+
+
+'''
+Warm-up
+'''
+# Compile kernels without solving, then exit (If run with --warmup)
+if terminal_options.flag("warmup"):
+    cheb_fet.warmup(F, smegub, J = J if partition is None else None, partition = partition)
+    cheb_fet.FETassemble_batch(dissipation, timestep)
+    sys.exit()
+
 
 
 '''
@@ -400,46 +458,47 @@ if mesh.comm.rank == 0:
 '''
 Solve
 '''
+# Create stepper (Solving for smegub, recording dissipation, and updating variables)
+# (Extrapolating the initial guess for each timestep from the previous one if run with --extrapolate, reusing the LU factorisation as a preconditioner across Newton iterations and timesteps if run with --reuse, and timing factorisations if run with --log)
+stepper = cheb_fet.FETStepper(
+    F,
+    smegub,
+    timestep,
+    updates = [
+        (sigma_sub, (sme_, 0), (smegub, 0)),
+        (mu_sub, (sme_, 1), (smegub, 1)),
+        (ln_eps_sub, (sme_, 2), (smegub, 2)),
+    ],
+    diagnostics = dissipation,
+    predictor = "extrapolate" if terminal_options.flag("extrapolate") else None,
+    reuse = "adaptive" if terminal_options.flag("reuse") else None,
+    log = terminal_options.flag("log"),
+    solver_parameters = sp,
+    J = J if partition is None else None,
+    partition = partition
+)
+
 time = Constant(0.0)
 while (float(time) < float(duration) - float(timestep)/2):
     # Print timestep
     print(RED % f"Solving for t = {float(time) + float(timestep)}:")
 
-    # Solve
-    solve(F == 0, smegub, solver_parameters = sp)
-
-    # Collect garbage
-    gc.collect()
-    
-    # Record dissipation
+    # Solve, record dissipation, and update variables
     # visc_diss = cheb_fet.FETassemble(
     #     lambda a, b, c, d, e : 2/Re * a*b * c * inner(tau(d), tau(e)) * dx,
     #     (sigma, sigma, beta_tilde, u_tilde, u_tilde),
     #     timestep
     # )
-    visc_diss = cheb_fet.FETassemble(
-        lambda a, b, c, d, e : 2/Re * a*b * c * inner(sym(grad(d)), sym(grad(e))) * dx,
-        (sigma, sigma, beta_tilde, u_tilde, u_tilde),
-        timestep
-    ) + cheb_fet.FETassemble(
-        lambda a, b, c, d, e : - 2/Re * 1/3 * a*b * c * inner(div(d), div(e)) * dx,
-        (sigma, sigma, beta_tilde, u_tilde, u_tilde),
-        timestep
-    )
-    ther_diss = cheb_fet.FETassemble(
-        lambda a, b, c : 1/Re/Pr * a**2 * theta(a**2, exp(b))**2 * inner(grad(c), grad(c)) * dx,
-        (sigma, ln_eps, beta_tilde),
-        timestep,
-        poly=False
-    )
+    (visc_diss_sym, visc_diss_div, ther_diss) = stepper.step()
+    print(BLUE % f"Newton iterations: {stepper.iterations[-1]}")
+    print(BLUE % f"Step time: {stepper.times[-1]:.2f}s")
+    if stepper.reuse == "adaptive":
+        refactors = stepper.refactors[-1]
+        print(BLUE % f"Factorisations: {refactors.count}{'' if refactors.time is None else f' ({refactors.time:.2f}s)'}, requested: {refactors.events}")
+    visc_diss = visc_diss_sym + visc_diss_div
     diss = visc_diss + ther_diss
     print(BLUE % f"Dissipation: {diss}")
 
-    # Update variables
-    sigma_sub.assign(cheb_fet.FETeval((sme_, 0), (smegub, 0), timestep, timestep))
-    mu_sub.assign(cheb_fet.FETeval((sme_, 1), (smegub, 1), timestep, timestep))
-    ln_eps_sub.assign(cheb_fet.FETeval((sme_, 2), (smegub, 2), timestep, timestep))
-
     # Write to Paraview
     pvd.write(sigma_sub, mu_sub, ln_eps_sub)
 
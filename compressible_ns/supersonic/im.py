@@ -1,7 +1,9 @@
 # Imports
 from firedrake import *
+import avfet_modules.terminal_options as terminal_options
 import numpy as np
 import gc
+import sys
 
 
 
@@ -179,6 +181,30 @@ sp = {
 
 
 
+# Dissipation forms
+visc_diss_form = 2/Re * rho / theta(rho, eps) * inner(tau(u), tau(u)) * timestep * dx
+ther_diss_form = 1/Re/Pr * rho / theta(rho, eps)**2 * inner(grad(theta(rho, eps)), grad(theta(rho, eps))) * timestep * dx
+
+
+
+#####
+
+
+
+# Compile kernels without solving, then exit (If run with --warmup)
+if terminal_options.flag("warmup"):
+    assemble(F)
+    assemble(derivative(F, sme), mat_type = "aij")
+    assemble(visc_diss_form)
+    assemble(ther_diss_form)
+    sys.exit()
+
+
+
+#####
+
+
+
 # Record IC values
 #   Create ParaView file
 pvd = File("output/compressible_ns/supersonic/im/solution.pvd")
@@ -249,8 +275,8 @@ while (float(time) < float(duration) - float(timestep)/2):
 
 
     # Record dissipation
-    visc_diss = assemble(2/Re * rho / theta(rho, eps) * inner(tau(u), tau(u)) * timestep * dx)
-    ther_diss = assemble(1/Re/Pr * rho / theta(rho, eps)**2 * inner(grad(theta(rho, eps)), grad(theta(rho, eps))) * timestep * dx)
+    visc_diss = assemble(visc_diss_form)
+    ther_diss = assemble(ther_diss_form)
     diss = visc_diss + ther_diss
     print(BLUE % f"Dissipation: {diss}")
 
@@ -4,9 +4,10 @@ Imports
 from firedrake import *
 import avfet_modules.cheb_fet as cheb_fet
 import avfet_modules.project_tools as project_tools
+import avfet_modules.terminal_options as terminal_options
 from scipy import special
 import math
-import gc
+import sys
 
 
 
@@ -109,6 +110,7 @@ k = 2  # (Max.) spatial degree (Must be >=2)
 s = 3  # (Max.) temporal degree (Must be >=1 | Equiv. to no. of steps in timestepping scheme)
 duration = 3*2**(-6)
 timestep = Constant(2**(-10))
+layout = "block"  # Layout of coefficients in time ("block" or "interleaved")
 
 # Setting
 Re_arr = [2**(2*i) for i in range(0, 9)]
@@ -135,9 +137,9 @@ P_ = FunctionSpace(mesh, "CG", k-1)
 R_ = FunctionSpace(mesh, "R", 0)
 
 # Individual (space-time) spaces (For composition...)
-U = cheb_fet.FETVectorFunctionSpace(mesh, "CG", k, s-1)
-P = cheb_fet.FETFunctionSpace(mesh, "CG", k-1, s-1)
-R = cheb_fet.FETFunctionSpace(mesh, "R", 0, s-1)
+U = cheb_fet.FETVectorFunctionSpace(mesh, "CG", k, s-1, layout=layout)
+P = cheb_fet.FETFunctionSpace(mesh, "CG", k-1, s-1, layout=layout)
+R = cheb_fet.FETFunctionSpace(mesh, "R", 0, s-1, layout=layout)
 
 # Mixed (space-time) spaces (...as required)
 UPOP  = cheb_fet.FETMixedFunctionSpace([U, P, R, R, R, U, P, R, R, R])
@@ -183,7 +185,7 @@ Re = Constant(1)
 
 
 # Initialise residual
-F = 0
+F = cheb_fet.ResidualBuilder()
 
 
 
@@ -191,36 +193,44 @@ F = 0
 F = cheb_fet.residual(
     F,
     lambda a, b : inner(a, b)*dx,
-    (u_t, v)
+    (u_t, v),
+    kron=True
 )
 F = cheb_fet.residual(
     F,
     lambda a, b, c : - inner(cross(a, b), c)*dx,
-    (u_tilde, omega, v)
+    (u_tilde, omega, v),
+    poly=False,
+    literal=True,
+    leg_pts="exact"
 )
 F = cheb_fet.residual(
     F,
     lambda a, b : 1/Re * inner(grad(a), grad(b))*dx,
-    (u_tilde, v)
+    (u_tilde, v),
+    kron=True
 )
 
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(a, div(b))*dx,
-    (p, v)
+    (p, v),
+    kron=True
 )
 for (i, f_i) in enumerate([f_1, f_2, f_3]):
     F = cheb_fet.residual(
         F,
         lambda a, b : - inner(a, b[i])*dx,
-        (f_i, v)
+        (f_i, v),
+        linear=True
     )
 
 # u incompressibility
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(div(a), b)*dx,
-    (u_tilde, q)
+    (u_tilde, q),
+    kron=True
 )
 
 # u stationary
@@ -228,7 +238,8 @@ for (i, g_i) in enumerate([g_1, g_2, g_3]):
     F = cheb_fet.residual(
         F,
         lambda a, b : - inner(a[i], b)*dx,
-        (u_tilde, g_i)
+        (u_tilde, g_i),
+        linear=True
     )
 
 
@@ -237,31 +248,36 @@ for (i, g_i) in enumerate([g_1, g_2, g_3]):
 F = cheb_fet.residual(
     F,
     lambda a, b : inner(a, b)*dx,
-    (omega, v_omega)
+    (omega, v_omega),
+    kron=True
 )
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(curl(a), b)*dx,
-    (u, v_omega)
+    (u, v_omega),
+    kron=True
 )
 
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(a, div(b))*dx,
-    (p_omega, v_omega)
+    (p_omega, v_omega),
+    kron=True
 )
 for (i, f_i_omega) in enumerate([f_1_omega, f_2_omega, f_3_omega]):
     F = cheb_fet.residual(
         F,
         lambda a, b : - inner(a, b[i])*dx,
-        (f_i_omega, v_omega)
+        (f_i_omega, v_omega),
+        linear=True
     )
 
 # omega incompressibility
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(div(a), b)*dx,
-    (omega, q_omega)
+    (omega, q_omega),
+    kron=True
 )
 
 # omega stationary
@@ -269,7 +285,8 @@ for (i, g_i_omega) in enumerate([g_1_omega, g_2_omega, g_3_omega]):
     F = cheb_fet.residual(
         F,
         lambda a, b : - inner(a[i], b)*dx,
-        (omega, g_i_omega)
+        (omega, g_i_omega),
+        linear=True
     )
 
 
@@ -301,6 +318,47 @@ sp = {
 
 
 
+'''
+Diagnostics
+'''
+# Energy and helicity dissipation
+dissipation = [
+    (lambda a, b : 1/Re * inner(grad(a), grad(b))*dx, (u_tilde, u_tilde)),
+    (lambda a, b : 1/Re * inner(grad(a), grad(b))*dx, (u_tilde, omega)),
+]
+
+
+
+'''
+Warm-up
+'''
+# Compile kernels without solving, then exit (If run with --warmup)
+if terminal_options.flag("warmup"):
+    cheb_fet.warmup(F, upop)
+    cheb_fet.FETassemble_batch(dissipation, timestep)
+    sys.exit()
+
+
+
+'''
+Stepper
+'''
+# Create stepper (Solving for upop, recording dissipation, and updating u; kept across Reynolds nos., so its matrix, sparsity pattern and symbolic factorisation are reused)
+# (Extrapolating the initial guess for each timestep from the previous one if run with --extrapolate, reusing the LU factorisation as a preconditioner across Newton iterations and timesteps if run with --reuse, and timing factorisations if run with --log)
+stepper = cheb_fet.FETStepper(
+    F,
+    upop,
+    timestep,
+    updates = [(u_, (u_, None), (upop, 0))],
+    diagnostics = dissipation,
+    predictor = "extrapolate" if terminal_options.flag("extrapolate") else None,
+    reuse = "adaptive" if terminal_options.flag("reuse") else None,
+    log = terminal_options.flag("log"),
+    solver_parameters = sp
+)
+
+
+
 '''
 Solve loop
 '''
@@ -311,6 +369,7 @@ for (i, Re_) in enumerate(Re_arr):
     # Reset
     Re.assign(Re_)
     u_.assign(u_ref)
+    stepper.reset()
 
 
 
@@ -357,30 +416,16 @@ for (i, Re_) in enumerate(Re_arr):
         # Print timestep
         print(RED % f"Solving for t = {float(time) + float(timestep)}:")
 
-        # Solve
-        solve(F==0, upop, solver_parameters=sp)
-
-        # Collect garbage
-        gc.collect()
-        
-        # Record dissipation
-        energy_diss = cheb_fet.FETassemble(
-            lambda a, b : 1/Re * inner(grad(a), grad(b))*dx,
-            (u_tilde, u_tilde),
-            timestep
-        )
+        # Solve, record dissipation, and update u
+        (energy_diss, helicity_diss) = stepper.step()
+        print(BLUE % f"Newton iterations: {stepper.iterations[-1]}")
+        print(BLUE % f"Step time: {stepper.times[-1]:.2f}s")
+        if stepper.reuse == "adaptive":
+            refactors = stepper.refactors[-1]
+            print(BLUE % f"Factorisations: {refactors.count}{'' if refactors.time is None else f' ({refactors.time:.2f}s)'}, requested: {refactors.events}")
         print(BLUE % f"Energy dissipation: {energy_diss}")
-
-        helicity_diss = cheb_fet.FETassemble(
-            lambda a, b : 1/Re * inner(grad(a), grad(b))*dx,
-            (u_tilde, omega),
-            timestep
-        )
         print(BLUE % f"Helicity dissipation: {helicity_diss}")
 
-        # Update u
-        u_.assign(cheb_fet.FETeval((u_, None), (upop, 0), timestep, timestep))
-
         # Write to Paraview
         pvd.write(u_)
 
@@ -4,9 +4,10 @@ Imports
 from firedrake import *
 import avfet_modules.cheb_fet as cheb_fet
 import avfet_modules.project_tools as project_tools
+import avfet_modules.terminal_options as terminal_options
 from scipy import special
 import math
-import gc
+import sys
 
 
 
@@ -183,7 +184,7 @@ Re = Constant(1)
 
 
 # Initialise residual
-F = 0
+F = cheb_fet.ResidualBuilder()
 
 
 
@@ -191,36 +192,44 @@ F = 0
 F = cheb_fet.residual(
     F,
     lambda a, b : inner(a, b)*dx,
-    (u_t, v)
+    (u_t, v),
+    kron=True
 )
 F = cheb_fet.residual(
     F,
     lambda a, b, c : - inner(cross(a, curl(b)), c)*dx,
-    (u_tilde, u, v)
+    (u_tilde, u, v),
+    poly=False,
+    literal=True,
+    leg_pts="exact"
 )
 F = cheb_fet.residual(
     F,
     lambda a, b : 1/Re * inner(grad(a), grad(b))*dx,
-    (u_tilde, v)
+    (u_tilde, v),
+    kron=True
 )
 
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(a, div(b))*dx,
-    (p, v)
+    (p, v),
+    kron=True
 )
 for (i, f_i) in enumerate([f_1, f_2, f_3]):
     F = cheb_fet.residual(
         F,
         lambda a, b : - inner(a, b[i])*dx,
-        (f_i, v)
+        (f_i, v),
+        linear=True
     )
 
 # u incompressibility
 F = cheb_fet.residual(
     F,
     lambda a, b : - inner(div(a), b)*dx,
-    (u_tilde, q)
+    (u_tilde, q),
+    kron=True
 )
 
 # u stationary
@@ -228,7 +237,8 @@ for (i, g_i) in enumerate([g_1, g_2, g_3]):
     F = cheb_fet.residual(
         F,
         lambda a, b : - inner(a[i], b)*dx,
-        (u_tilde, g_i)
+        (u_tilde, g_i),
+        linear=True
     )
 
 
@@ -260,6 +270,46 @@ sp = {
 
 
 
+'''
+Diagnostics
+'''
+# Energy dissipation
+dissipation = [
+    (lambda a, b : 1/Re * inner(grad(a), grad(b))*dx, (u_tilde, u_tilde)),
+]
+
+
+
+'''
+Warm-up
+'''
+# Compile kernels without solving, then exit (If run with --warmup)
+if terminal_options.flag("warmup"):
+    cheb_fet.warmup(F, up)
+    cheb_fet.FETassemble_batch(dissipation, timestep)
+    sys.exit()
+
+
+
+'''
+Stepper
+'''
+# Create stepper (Solving for up, recording dissipation, and updating u; kept across Reynolds nos., so its matrix, sparsity pattern and symbolic factorisation are reused)
+# (Extrapolating the initial guess for each timestep from the previous one if run with --extrapolate, reusing the LU factorisation as a preconditioner across Newton iterations and timesteps if run with --reuse, and timing factorisations if run with --log)
+stepper = cheb_fet.FETStepper(
+    F,
+    up,
+    timestep,
+    updates = [(u_, (u_, None), (up, 0))],
+    diagnostics = dissipation,
+    predictor = "extrapolate" if terminal_options.flag("extrapolate") else None,
+    reuse = "adaptive" if terminal_options.flag("reuse") else None,
+    log = terminal_options.flag("log"),
+    solver_parameters = sp
+)
+
+
+
 '''
 Solve loop
 '''
@@ -270,6 +320,7 @@ for (i, Re_) in enumerate(Re_arr):
     # Reset
     Re.assign(Re_)
     u_.assign(u_ref)
+    stepper.reset()
 
 
 
@@ -315,23 +366,15 @@ for (i, Re_) in enumerate(Re_arr):
         # Print timestep
         print(RED % f"Solving for t = {float(time) + float(timestep)}:")
 
-        # Solve
-        solve(F==0, up, solver_parameters=sp)
-
-        # Collect garbage
-        gc.collect()
-        
-        # Record dissipation
-        energy_diss = cheb_fet.FETassemble(
-            lambda a, b : 1/Re * inner(grad(a), grad(b))*dx,
-            (u_tilde, u_tilde),
-            timestep
-        )
+        # Solve, record dissipation, and update u
+        (energy_diss,) = stepper.step()
+        print(BLUE % f"Newton iterations: {stepper.iterations[-1]}")
+        print(BLUE % f"Step time: {stepper.times[-1]:.2f}s")
+        if stepper.reuse == "adaptive":
+            refactors = stepper.refactors[-1]
+            print(BLUE % f"Factorisations: {refactors.count}{'' if refactors.time is None else f' ({refactors.time:.2f}s)'}, requested: {refactors.events}")
         print(BLUE % f"Energy dissipation: {energy_diss}")
 
-        # Update u
-        u_.assign(cheb_fet.FETeval((u_, None), (up, 0), timestep, timestep))
-
         # Write to Paraview
         pvd.write(u_)
 